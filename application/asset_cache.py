@@ -0,0 +1,92 @@
+"""
+Description: This module contains the image cache used by the SUSTAIN chat
+application. Each logo is decoded and scaled once per process, and the scaled
+result can also be written to disk so later launches can hand a small PNG
+straight to Tk without decoding and resizing the full-size original again.
+"""
+
+# Import required libraries
+import os
+import hashlib
+import logging
+import threading
+import tkinter as tk
+
+LOGO_SIZE = (200, 200)
+
+
+class AssetCache:
+    """Decodes and scales images once; Tk photo images are created on the main thread."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.scaled = {}  # (path, size) -> scaled PIL image, filled by preload()
+        self.photos = {}  # (path, size) -> Tk photo image
+        self.lock = threading.Lock()
+
+    def photo(self, path, max_size=LOGO_SIZE):
+        """Return a Tk photo image of the file scaled to fit max_size. Must be called from the Tk thread."""
+        key = (path, tuple(max_size))
+        photo = self.photos.get(key)
+        if photo is not None:
+            return photo
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Logo file not found at: {path}")
+
+        disk_path = self.disk_path(path, max_size)
+        with self.lock:
+            image = self.scaled.pop(key, None)
+        if image is None and disk_path and os.path.exists(disk_path):
+            # Tk reads PNGs natively, so a cached copy needs neither Pillow nor a resize
+            photo = tk.PhotoImage(file=disk_path)
+        else:
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(image if image is not None else self.scale(path, max_size))
+        self.photos[key] = photo
+        return photo
+
+    def preload(self, paths, max_size=LOGO_SIZE):
+        """Decode and scale images ahead of time. Safe to run on a background thread."""
+        for path in paths:
+            key = (path, tuple(max_size))
+            disk_path = self.disk_path(path, max_size)
+            if key in self.photos or (disk_path and os.path.exists(disk_path)):
+                continue
+            try:
+                image = self.scale(path, max_size)
+            except Exception as e:
+                logging.error(f"Failed to preload {path}: {str(e)}")
+                continue
+            with self.lock:
+                self.scaled[key] = image
+
+    def scale(self, path, max_size):
+        """Decode and scale an image, writing the result to the disk cache if one is set."""
+        from PIL import Image
+        image = Image.open(path)
+        image.thumbnail(max_size, Image.LANCZOS)
+
+        disk_path = self.disk_path(path, max_size)
+        if disk_path:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Write to a temporary file first so a partial write is never read back
+                temporary_path = f"{disk_path}.{threading.get_ident()}.tmp"
+                image.save(temporary_path, format="PNG")
+                os.replace(temporary_path, disk_path)
+            except OSError as e:
+                logging.error(f"Failed to cache {path} on disk: {str(e)}")
+        return image
+
+    def disk_path(self, path, max_size):
+        """Return where the scaled copy lives on disk, or None without a disk cache."""
+        if not self.cache_dir:
+            return None
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        # The name changes whenever the source image or the requested size does
+        digest = hashlib.sha1(f"{os.path.abspath(path)}:{modified}:{max_size[0]}x{max_size[1]}".encode("utf-8"))
+        return os.path.join(self.cache_dir, digest.hexdigest() + ".png")
@@ -0,0 +1,176 @@
+'''
+Description: This file runs the SUSTAIN optimizers offline over large prompt logs
+without calling the API. Prompts are streamed from a JSONL or CSV file, optimized
+in chunks across a process pool, and written out one result per row together with
+aggregate token savings. Memory use stays bounded however large the input is.
+
+Usage:
+    python batch_optimize.py prompts.jsonl --output results.jsonl
+    python batch_optimize.py prompts.csv --field prompt --workers 8 --summary summary.json
+'''
+
+# Import required libraries
+import os
+import sys
+import csv
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from sustain import SUSTAIN, MathOptimizer, TextOptimizer, DEFAULT_MODEL
+
+# Optimizers owned by each worker process
+_text_optimizer = None
+_math_optimizer = None
+_model = DEFAULT_MODEL
+
+
+def init_worker(model):
+    """Build the optimizers once per worker process."""
+    global _text_optimizer, _math_optimizer, _model
+    _text_optimizer = TextOptimizer(model)
+    _math_optimizer = MathOptimizer()
+    _model = model
+
+
+def process_chunk(rows):
+    """Optimize a chunk of (row number, prompt) pairs and count their tokens.
+
+    Returns the per-row results and the tokens saved by each rewrite rule.
+    """
+    prompts = [prompt for _, prompt in rows]
+    rule_savings = {}
+    optimized = [_text_optimizer.optimize_text(prompt, rule_savings) for prompt in prompts]
+    counts = SUSTAIN.count_tokens_many(prompts + optimized, _model)
+    original_counts, optimized_counts = counts[:len(prompts)], counts[len(prompts):]
+
+    results = []
+    for (row, prompt), optimized_prompt, original_tokens, optimized_tokens in zip(
+        rows, optimized, original_counts, optimized_counts
+    ):
+        # Math prompts are answered locally, so none of their tokens are sent
+        math_result = None
+        if _math_optimizer.recognize_math(prompt):
+            math_result = _math_optimizer.solve_math(prompt)
+        sent_tokens = 0 if math_result is not None else optimized_tokens
+        results.append({
+            "row": row,
+            "optimized": optimized_prompt,
+            "math": math_result is not None,
+            "math_result": math_result,
+            "original_tokens": original_tokens,
+            "optimized_tokens": optimized_tokens,
+            "sent_tokens": sent_tokens,
+            "tokens_saved": original_tokens - sent_tokens,
+        })
+    return results, rule_savings
+
+
+def read_prompts(file, input_format, field):
+    """Yield (row number, prompt) pairs from a JSONL or CSV file, one row at a time."""
+    if input_format == "csv":
+        for row, record in enumerate(csv.DictReader(file), start=1):
+            prompt = record.get(field)
+            if prompt:
+                yield row, prompt
+        return
+
+    for row, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        prompt = record.get(field) if isinstance(record, dict) else record
+        if isinstance(prompt, str) and prompt:
+            yield row, prompt
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def optimize_file(prompts, output, workers, chunk_size, model=DEFAULT_MODEL):
+    """Optimize every prompt, writing per-row results in input order, and return the totals."""
+    totals = {"rows": 0, "math_rows": 0, "original_tokens": 0, "sent_tokens": 0}
+    rule_savings = {}
+
+    def write(chunk_results):
+        results, chunk_savings = chunk_results
+        for rule, tokens in chunk_savings.items():
+            rule_savings[rule] = rule_savings.get(rule, 0) + tokens
+        for result in results:
+            output.write(json.dumps(result) + "\n")
+            totals["rows"] += 1
+            totals["math_rows"] += result["math"]
+            totals["original_tokens"] += result["original_tokens"]
+            totals["sent_tokens"] += result["sent_tokens"]
+
+    # Only a few chunks per worker are in flight, so the input is never read ahead
+    # of what the pool can process
+    max_in_flight = workers * 2
+    in_flight = deque()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(model,)) as pool:
+        for chunk in chunked(prompts, chunk_size):
+            if len(in_flight) >= max_in_flight:
+                write(in_flight.popleft().result())
+            in_flight.append(pool.submit(process_chunk, chunk))
+        while in_flight:
+            write(in_flight.popleft().result())
+
+    totals["tokens_saved"] = totals["original_tokens"] - totals["sent_tokens"]
+    totals["percentage_saved"] = SUSTAIN.calculate_percentage_saved(
+        totals["original_tokens"], totals["sent_tokens"]
+    )
+    # Which rules earn their keep, most tokens saved first
+    totals["rule_savings"] = dict(sorted(rule_savings.items(), key=lambda item: item[1], reverse=True))
+    return totals
+
+
+# Main function to run the batch optimizer
+def main():
+    parser = argparse.ArgumentParser(
+        description="Optimize a prompt log offline and report the token savings."
+    )
+    parser.add_argument("input", help="JSONL or CSV file of prompts, or - for stdin")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from the file extension)")
+    parser.add_argument("--field", default="prompt", help="Field or column that holds the prompt")
+    parser.add_argument("--output", default="-", help="Where to write per-row results (default: stdout)")
+    parser.add_argument("--summary", help="Also write the aggregate savings to this JSON file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Rows sent to a worker at a time")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model whose tokenizer is used for counting")
+    args = parser.parse_args()
+
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    input_file = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        totals = optimize_file(
+            read_prompts(input_file, input_format, args.field),
+            output_file, args.workers, args.chunk_size, args.model
+        )
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as file:
+            json.dump(totals, file, indent=2)
+    print(json.dumps(totals), file=sys.stderr)
+
+
+# Run the main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Description: This module contains the micro-batcher used by SUSTAIN. Short prompts
+that arrive within a few milliseconds of each other are sent to the API as one
+numbered multi-question request, and the numbered answers are handed back to each
+caller. Prompts whose answer cannot be found in the reply are sent on their own.
+"""
+
+# Import required libraries
+import re
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+BATCH_INSTRUCTIONS = (
+    "Answer each numbered question below in under 20 words. Reply with exactly one "
+    "line per question, starting with its number, like \"1. answer\"."
+)
+ANSWER_LINE = re.compile(r'^\s*(\d+)\s*[.):]\s*(.+?)\s*$')
+
+
+class MicroBatcher:
+    """Collects prompts for a short window and answers them with one API call.
+
+    It has the same get_openai_response methods as OpenAIClient, so it can be used
+    in its place.
+    """
+
+    def __init__(self, api_client, window=0.005, max_batch=8, max_workers=4, metrics=None):
+        self.api_client = api_client
+        self.model = api_client.model
+        self.window = window  # Seconds to wait for more prompts after the first one
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self.pending = []  # (prompt, Future) waiting for the next batch
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sustain-batch")
+        self.dispatcher = None
+        self.closed = False
+
+        self.stats_lock = threading.Lock()
+        self.batches = 0  # Multi-question requests sent
+        self.prompts = 0  # Prompts answered through the batcher
+        self.api_calls = 0  # Requests made, batched or not
+        self.fallbacks = 0  # Prompts resent on their own after a batch reply missed them
+
+    def get_openai_response(self, user_input):
+        return self.enqueue(user_input).result()
+
+    async def get_openai_response_async(self, user_input):
+        return await asyncio.wrap_future(self.enqueue(user_input))
+
+    def enqueue(self, user_input):
+        """Add a prompt to the next batch and return a Future for its answer."""
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The batcher has been closed")
+            self.pending.append((user_input, future))
+            if self.dispatcher is None:
+                self.dispatcher = threading.Thread(target=self.dispatch, name="sustain-batcher", daemon=True)
+                self.dispatcher.start()
+            self.condition.notify()
+        return future
+
+    def dispatch(self):
+        """Cut the pending prompts into batches and hand each batch to a worker."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.pending:
+                    return
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_batch and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+            self.executor.submit(self.send, batch)
+
+    def send(self, batch):
+        if len(batch) == 1:
+            self.send_single(*batch[0])
+            return
+
+        prompts = [prompt for prompt, _ in batch]
+        self.count(batches=1, api_calls=1, prompts=len(batch))
+        try:
+            reply = self.api_client.complete(
+                self.build_messages(prompts), self.api_client.max_tokens * len(prompts)
+            )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        answers = self.split_answers(reply, len(prompts))
+        missing = []
+        for number, (prompt, future) in enumerate(batch, start=1):
+            if number in answers:
+                future.set_result(answers[number])
+            else:
+                missing.append((prompt, future))
+
+        if missing:
+            self.count(fallbacks=len(missing))
+            for prompt, future in missing:
+                self.send_single(prompt, future, counted=True)
+
+    def send_single(self, prompt, future, counted=False):
+        self.count(api_calls=1, prompts=0 if counted else 1)
+        try:
+            future.set_result(self.api_client.get_openai_response(prompt))
+        except Exception as e:
+            future.set_exception(e)
+
+    @staticmethod
+    def build_messages(prompts):
+        """Build one request that asks every prompt as a numbered question."""
+        questions = "\n".join(
+            f"{number}. {' '.join(prompt.split())}" for number, prompt in enumerate(prompts, start=1)
+        )
+        return [{"role": "user", "content": f"{BATCH_INSTRUCTIONS}\n\n{questions}"}]
+
+    @staticmethod
+    def split_answers(reply, count):
+        """Return {question number: answer} for the numbered answer lines found in the reply."""
+        answers = {}
+        for line in reply.splitlines():
+            match = ANSWER_LINE.match(line)
+            if match:
+                number = int(match.group(1))
+                if 1 <= number <= count and number not in answers:
+                    answers[number] = match.group(2)
+        return answers
+
+    def count(self, **amounts):
+        with self.stats_lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+        if self.metrics is not None:
+            for name, amount in amounts.items():
+                if amount:
+                    self.metrics.increment(f"batcher_{name}", amount)
+
+    def stats(self):
+        """Return the batch sizes, requests saved and how often batches had to fall back."""
+        with self.stats_lock:
+            batched = self.prompts - (self.api_calls - self.batches - self.fallbacks)
+            return {
+                "batches": self.batches,
+                "prompts": self.prompts,
+                "api_calls": self.api_calls,
+                "fallbacks": self.fallbacks,
+                "mean_batch_size": batched / self.batches if self.batches else 0.0,
+                "prompts_per_call": self.prompts / self.api_calls if self.api_calls else 0.0,
+                "fallback_rate": self.fallbacks / batched if batched else 0.0,
+            }
+
+    def close(self):
+        """Send whatever is pending, then stop the dispatcher and workers."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        self.executor.shutdown(wait=True)
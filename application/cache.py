@@ -0,0 +1,314 @@
+"""
+Description: This module contains the response cache used by SUSTAIN. A small
+in-memory tier sits in front of a pluggable persistent backend so cached answers
+survive restarts and can be shared by several processes on the same host.
+"""
+
+# Import required libraries
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../sustain_cache.db')
+)
+DEFAULT_TTL = 7 * 24 * 60 * 60  # One week
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64 MB
+TOUCH_BATCH = 64  # Memory hits queued before the backend's access times are updated
+TOUCH_INTERVAL = 5.0  # Seconds between those updates at most
+
+
+class CacheBackend:
+    """Interface for persistent response cache stores."""
+
+    def get(self, key):
+        """Return the cached value for the key, or None on a miss."""
+        raise NotImplementedError
+
+    def get_entry(self, key):
+        """Return (value, expires_at) for the key, or None on a miss. expires_at is None if unknown."""
+        value = self.get(key)
+        return None if value is None else (value, None)
+
+    def touch(self, keys):
+        """Mark keys as recently used, e.g. after they were served from a faster tier."""
+
+    def set(self, key, value):
+        """Store a JSON-serializable value under the key."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return the backend's counters."""
+        return {}
+
+    def close(self):
+        """Release any resources held by the backend."""
+
+
+class SQLiteCache(CacheBackend):
+    """SQLite-backed cache with a TTL and a byte-size cap enforced by LRU eviction."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+        # WAL mode lets several processes read while one of them writes
+        self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires_at)"
+            )
+            # The total size of the stored entries lives in the database and is kept
+            # up to date by triggers, so every process sharing the file sees the same
+            # total and writes never have to sum the table
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses "
+                "BEGIN UPDATE meta SET total_bytes = total_bytes + NEW.size WHERE id = 0; END"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses "
+                "BEGIN UPDATE meta SET total_bytes = total_bytes - OLD.size WHERE id = 0; END"
+            )
+            self.connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_resized AFTER UPDATE OF size ON responses "
+                "BEGIN UPDATE meta SET total_bytes = total_bytes + NEW.size - OLD.size WHERE id = 0; END"
+            )
+            # Created after the triggers, so entries written in between are summed here
+            self.connection.execute(
+                "INSERT OR IGNORE INTO meta (id, total_bytes) "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+            )
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key):
+        now = time.time()
+        with self.lock:
+            try:
+                row = self.connection.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                value, expires_at = row
+                with self.connection:
+                    if expires_at is not None and expires_at <= now:
+                        self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self.expirations += 1
+                        self.misses += 1
+                        return None
+                    self.connection.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+            except sqlite3.Error as e:
+                logging.error(f"Cache read failed: {str(e)}")
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value), expires_at
+
+    def touch(self, keys):
+        now = time.time()
+        with self.lock:
+            try:
+                with self.connection:
+                    self.connection.executemany(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?", [(now, key) for key in keys]
+                    )
+            except sqlite3.Error as e:
+                logging.error(f"Cache touch failed: {str(e)}")
+
+    def set(self, key, value):
+        now = time.time()
+        payload = json.dumps(value)
+        size = len(key.encode('utf-8')) + len(payload.encode('utf-8'))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = now + self.ttl if self.ttl is not None else None
+        with self.lock:
+            try:
+                with self.connection:
+                    # An upsert rather than INSERT OR REPLACE, whose implicit delete
+                    # would not fire the size trigger
+                    self.connection.execute(
+                        "INSERT INTO responses (key, value, size, expires_at, accessed_at) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                        "value = excluded.value, size = excluded.size, "
+                        "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                        (key, payload, size, expires_at, now)
+                    )
+                    self._evict(now)
+            except sqlite3.Error as e:
+                logging.error(f"Cache write failed: {str(e)}")
+
+    def _evict(self, now):
+        """Drop expired entries, then least recently used ones until under the size cap."""
+        cursor = self.connection.execute(
+            "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+        )
+        self.expirations += max(cursor.rowcount, 0)
+        if self.max_bytes is None:
+            return
+
+        # Read inside the write transaction, so it includes every process's writes
+        total = self.connection.execute("SELECT total_bytes FROM meta WHERE id = 0").fetchone()[0]
+        while total > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self.connection.execute("SELECT total_bytes FROM meta WHERE id = 0").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": entries,
+                "bytes": total,
+            }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class TieredCache:
+    """Bounded in-memory LRU tier in front of an optional persistent backend."""
+
+    def __init__(self, backend=None, max_entries=1024, ttl=None):
+        self.backend = backend
+        self.max_entries = max_entries
+        # Hot entries share the backend's lifetime unless told otherwise
+        self.ttl = ttl if ttl is not None else getattr(backend, 'ttl', None)
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Keys served from memory whose backend access time has not been updated
+        # yet. They are written in batches so memory hits stay cheap, and so hot
+        # keys are not the first ones the backend evicts.
+        self.touched = set()
+        self.touched_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for the key, or None on a miss."""
+        touched = None
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    touched = self._mark_touched(key)
+                else:
+                    del self.memory[key]
+                    entry = None
+        if entry is not None:
+            if touched:
+                self.backend.touch(touched)
+            return value
+
+        entry = self.backend.get_entry(key) if self.backend is not None else None
+        if entry is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        value, expires_at = entry
+        self._remember(key, value, expires_at)
+        return value
+
+    def set(self, key, value):
+        """Store the value in both tiers."""
+        self._remember(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def _mark_touched(self, key):
+        """Queue a memory hit for the backend; return the keys to flush, if it is time."""
+        if self.backend is None:
+            return None
+        self.touched.add(key)
+        now = time.monotonic()
+        if len(self.touched) < TOUCH_BATCH and now - self.touched_at < TOUCH_INTERVAL:
+            return None
+        touched, self.touched, self.touched_at = self.touched, set(), now
+        return touched
+
+    def flush_touched(self):
+        """Write out the queued memory hits to the backend."""
+        with self.lock:
+            touched, self.touched, self.touched_at = self.touched, set(), time.monotonic()
+        if touched and self.backend is not None:
+            self.backend.touch(touched)
+
+    def _remember(self, key, value, backend_expires_at=None):
+        # A value read from the backend is never kept past its persistent expiry
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        if backend_expires_at is not None:
+            expires_at = backend_expires_at if expires_at is None else min(expires_at, backend_expires_at)
+        with self.lock:
+            self.memory[key] = (value, expires_at)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit, miss and eviction counters for each tier."""
+        with self.lock:
+            stats = {
+                "memory": {
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.memory),
+                }
+            }
+        if self.backend is not None:
+            stats["persistent"] = self.backend.stats()
+        return stats
+
+    def close(self):
+        if self.backend is not None:
+            self.flush_touched()
+            self.backend.close()
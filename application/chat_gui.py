@@ -6,11 +6,16 @@ The application also calculates the average token savings and CO2 emissions save
 """
 # Import required libraries
 import os
+import queue
+import threading
 import tkinter as tk
-from tkinter import scrolledtext, PhotoImage, filedialog
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import PhotoImage, filedialog
 from dotenv import load_dotenv
-from sustain import SUSTAIN
-from PIL import Image, ImageTk
+from asset_cache import AssetCache
+from log_config import request_context
+from transcript import TranscriptView
 import platform
 
 # Load environment variables from .env file
@@ -34,8 +39,19 @@ def create_rounded_rectangle(canvas, x1, y1, x2, y2, radius=25, **kwargs):
 # Add the method to Canvas class
 tk.Canvas.create_rounded_rectangle = create_rounded_rectangle
 
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+LOGO_PATHS = {
+    True: os.path.join(ASSETS_DIR, "SUSTAINOriginalWhiteTransparentCropped.png"),  # Dark mode
+    False: os.path.join(ASSETS_DIR, "SUSTAINOriginalBlackTransparentCropped.png"),  # Light mode
+}
+# Scaled logos are kept here between launches; set SUSTAIN_ASSET_CACHE_DIR to "" to disable
+DEFAULT_ASSET_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.sustain_assets")
+
+
 # Create a chat application using Tkinter
 class ChatApp:
+    RESULT_POLL_MS = 50  # How often finished SUSTAIN calls are collected
+
     def __init__(self, root, track_token_length):
         self.track_token_length = track_token_length
         self.root = root
@@ -43,7 +59,6 @@ class ChatApp:
         # self.root.attributes("-fullscreen", True)
         self.root.geometry("800x800")
         self.root.iconbitmap("application/assets/icon_Scz_icon.ico")
-        self.message_history = []
 
         # Detect the system the user has
         system = platform.system()
@@ -84,23 +99,9 @@ class ChatApp:
         self.top_frame = tk.Frame(root)
         self.top_frame.pack(fill=tk.X, pady=10)
 
-        # Load and display the dark mode logo
-        logo_path = os.path.abspath(
-            os.path.join(
-                os.path.dirname(__file__),
-                "assets/SUSTAINOriginalWhiteTransparentCropped.png"
-            )
-        )
-        if os.path.exists(logo_path):
-            original_logo = Image.open(logo_path)
-            max_size = (200, 200)
-            original_logo.thumbnail(max_size, Image.LANCZOS)
-            self.logo = ImageTk.PhotoImage(original_logo)
-        else:
-            raise FileNotFoundError(f"Logo file not found at: {logo_path}")
-
-        # Logo label with dark mode background
-        self.logo_label = tk.Label(self.top_frame, image=self.logo, bg="#1e1e1e")
+        # Logos are decoded and scaled once; apply_theme picks the one to show
+        self.assets = AssetCache(os.getenv("SUSTAIN_ASSET_CACHE_DIR", DEFAULT_ASSET_CACHE_DIR))
+        self.logo_label = tk.Label(self.top_frame, bg="#1e1e1e")
         self.logo_label.pack(side=tk.LEFT, padx=10)
 
         # Info button at the top-right corner
@@ -115,20 +116,16 @@ class ChatApp:
         )
         self.info_button.pack(side=tk.RIGHT, padx=20)
 
-        # Create a chat area and entry field
-        self.chat_area = scrolledtext.ScrolledText(
-            root,
-            wrap=tk.WORD,
-            state='disabled',
-            height=25,
-            font=("Mangal_Pro", 16)
-        )
+        # Create a chat area and entry field. Only the visible messages are drawn,
+        # so long conversations stay responsive.
+        self.chat_area = TranscriptView(root, font=("Mangal_Pro", 16))
 
         self.chat_area.pack(padx=20, pady=10, fill=tk.BOTH, expand=True)
 
         self.entry = tk.Entry(root, font=("Mangal_Pro", 16))
         self.entry.pack(padx=20, pady=10, fill=tk.X, expand=True)
         self.entry.bind("<Return>", self.send_message)
+        self.entry.bind("<Escape>", self.cancel_responses)
 
         # Add a label to display token percentage saved
         self.token_savings_label = tk.Label(
@@ -175,13 +172,35 @@ class ChatApp:
         # Apply dark mode settings by default
         self.apply_theme(self.is_dark_mode)
 
-        # Initialize the SUSTAIN API
+        # Scale the other theme's logo in the background so toggling is instant
+        threading.Thread(
+            target=self.assets.preload, args=([LOGO_PATHS[not self.is_dark_mode]],), daemon=True
+        ).start()
+
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError(
                 "API key not found. Please set the OPENAI_API_KEY environment variable."
             )
-        self.sustain = SUSTAIN(api_key=self.api_key)
+
+        # SUSTAIN calls run on worker threads; finished results are handed back
+        # through a queue and drained on the Tk main loop
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sustain")
+        self.results = queue.Queue()
+        self.pending = deque()
+        self.completed = {}
+        self.cancelled = set()
+        self.next_request_id = 0
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(self.RESULT_POLL_MS, self.process_results)
+
+        # Initialize the SUSTAIN API in the background so the window shows up right
+        # away; prompts sent before it is ready wait in self.waiting
+        self.sustain = None
+        self.startup_error = None
+        self.waiting = []
+        threading.Thread(target=self.init_sustain, daemon=True).start()
+
         self.display_settings_message(
             "Welcome to SUSTAIN Chat! Ask me: \"What is SUSTAIN?\" to learn more."
         )
@@ -192,16 +211,14 @@ class ChatApp:
             # Dark mode settings
             bg_color, fg_color, button_bg, button_fg = "#1e1e1e", "white", "#3c3c3c", "white"
             info_button_bg = "#4CAD75"  # Green background for info button
-            logo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "assets/SUSTAINOriginalWhiteTransparentCropped.png"))
         else:
             # Light mode settings
             bg_color, fg_color, button_bg, button_fg = "#f5f5f5", "black", "#d9d9d9", "black"
             info_button_bg = "#4CAD75"  # Green background for info button
-            logo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "assets/SUSTAINOriginalBlackTransparentCropped.png"))
 
         # Apply theme to widgets
         self.root.configure(bg=bg_color)
-        self.chat_area.configure(bg=bg_color, fg=fg_color, insertbackground=fg_color)
+        self.chat_area.set_colors(bg_color, fg_color)
         self.entry.configure(bg=bg_color, fg=fg_color, insertbackground=fg_color)
         self.token_savings_label.configure(bg=bg_color, fg="#318752")
         self.top_frame.configure(bg=bg_color)
@@ -214,14 +231,11 @@ class ChatApp:
         self.logo_label.configure(bg=bg_color)
 
         # Update the logo
-        if os.path.exists(logo_path):
-            original_logo = Image.open(logo_path)
-            max_size = (200, 200)
-            original_logo.thumbnail(max_size, Image.LANCZOS)
-            self.logo = ImageTk.PhotoImage(original_logo)
+        try:
+            self.logo = self.assets.photo(LOGO_PATHS[is_dark_mode])
             self.logo_label.configure(image=self.logo)
-        else:
-            self.display_settings_message(f"Logo file not found at: {logo_path}")
+        except FileNotFoundError as e:
+            self.display_settings_message(str(e))
 
     def toggle_mode(self):
         """Toggle between dark and light mode."""
@@ -232,163 +246,140 @@ class ChatApp:
     def send_message(self, event):
         user_input = self.entry.get()
         if user_input:
-            self.message_history.append(user_input)
             self.display_message("You: " + user_input)
 
-            # Check if user input is a math expression
-            math_answer = self.sustain.answer_math(user_input)
-            if math_answer is not None:
-                # Display the result of the math expression directly
-                self.display_message(f"SUSTAIN: Math detected! Result: {math_answer}")
-                self.display_settings_message("You saved 100% tokens by using SUSTAIN's math optimizer!")
-                self.entry.delete(0, tk.END)
-
-                # Update token savings to 100% for math queries
-                self.message_count += 1
-                self.total_percentage_saved += 100  # Save 100% savings for math queries
-                average_savings = self.total_percentage_saved / self.message_count
-                self.token_savings_label.config(text=f"Average token savings: {average_savings:.2f}%. Thank you for going green!")
-
-                return  # Exit early to prevent API call
-
-            # Check if user input is a special command
-            if user_input.strip().lower() == "what is sustain?":
-                response = (
-                    "I am SUSTAIN, an environmentally-friendly, token-optimized AI wrapper designed to reduce compute costs "
-                    "and increase productivity. I filter out irrelevant words and phrases from prompts and limit responses to "
-                    "essential outputs, minimizing the number of tokens used."
-                )
-                percentage_saved = 0
+            # Show a placeholder bubble while SUSTAIN routes the prompt to its math
+            # optimizer, canned answers, cache or the API in the background
+            bubble = self.display_message("\nSUSTAIN: …")
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            self.pending.append((request_id, bubble, user_input))
+            if self.startup_error is not None:
+                self.completed[request_id] = (f"Error: {str(self.startup_error)}", 0, None)
+            elif self.sustain is None:
+                self.waiting.append((request_id, user_input))
             else:
-                response, percentage_saved = self.sustain.get_response(user_input)
-            
-            # Display the response from SUSTAIN
-            self.display_message("\nSUSTAIN: " + response)
-            if percentage_saved == 0:
-                self.display_settings_message("With SUSTAIN, you saved 0.00% more tokens compared to traditional AI!\n")
-            else:
-                self.display_settings_message(f"With SUSTAIN, you saved {percentage_saved:.2f}% more tokens compared to traditional AI!\n")
+                self.executor.submit(self.fetch_response, request_id, user_input)
             self.entry.delete(0, tk.END)
 
-            # Update token savings
-            self.message_count += 1
-            self.total_percentage_saved += percentage_saved
-            average_savings = self.total_percentage_saved / self.message_count
-            self.token_savings_label.config(text=f"Average token savings: {average_savings:.2f}%. Thank you for going green!")
+    def init_sustain(self):
+        """Build the SUSTAIN pipeline on a background thread and hand it to the Tk main loop."""
+        try:
+            # Imported here so loading the OpenAI, tiktoken and spaCy stack does not delay the window
+            from sustain import SUSTAIN
+            self.results.put(("ready", None, SUSTAIN(api_key=self.api_key)))
+        except Exception as e:
+            self.results.put(("failed", None, e))
+
+    def start_waiting(self):
+        """Send the prompts that arrived while SUSTAIN was starting up."""
+        for request_id, user_input in self.waiting:
+            self.executor.submit(self.fetch_response, request_id, user_input)
+        self.waiting = []
+
+    def fetch_response(self, request_id, user_input):
+        """Stream a response from SUSTAIN on a worker thread."""
+        try:
+            # Keep one request ID for everything logged while the response streams in
+            with request_context():
+                stream = self.sustain.get_response_stream(user_input)
+                for _ in stream:
+                    if request_id in self.cancelled:
+                        stream.close()
+                        break
+                    self.results.put(("chunk", request_id, stream.text))
+            result = (stream.text, stream.percentage_saved, stream.route)
+        except Exception as e:
+            result = (f"Error: {str(e)}", 0, None)
+        self.results.put(("done", request_id, result))
+
+    def cancel_responses(self, event=None):
+        """Stop every response that is still streaming."""
+        self.cancelled.update(request_id for request_id, _, _ in self.pending)
 
+    def process_results(self):
+        """Apply finished results, then poll again even if applying them failed."""
+        try:
+            self.apply_results()
+        finally:
+            self.root.after(self.RESULT_POLL_MS, self.process_results)
+
+    def apply_results(self):
+        """Update streaming bubbles and finish responses in the order their prompts were sent."""
+        streamed = {}
+        while True:
+            try:
+                kind, request_id, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "ready":
+                self.sustain = result
+                self.start_waiting()
+            elif kind == "failed":
+                self.startup_error = result
+                self.display_settings_message(f"SUSTAIN failed to start: {str(result)}")
+                for request_id, _ in self.waiting:
+                    self.completed[request_id] = (f"Error: {str(result)}", 0, None)
+                self.waiting = []
+            elif kind == "chunk":
+                # Only the latest text of each bubble needs drawing
+                streamed[request_id] = result
+            else:
+                streamed.pop(request_id, None)
+                self.completed[request_id] = result
+
+        for request_id, bubble, _ in self.pending:
+            if request_id in streamed:
+                self.update_bubble(bubble, streamed[request_id])
+
+        while self.pending and self.pending[0][0] in self.completed:
+            request_id, bubble, user_input = self.pending.popleft()
+            response, percentage_saved, route = self.completed.pop(request_id)
+            self.cancelled.discard(request_id)
+            if route == "math":
+                self.update_bubble(bubble, f"Math detected! Result: {response}")
+            else:
+                self.update_bubble(bubble, response)
+            self.show_savings(percentage_saved, route)
             self.track_token_length(user_input)
 
+    def show_savings(self, percentage_saved, route=None):
+        """Report the savings for one response and update the running average."""
+        if route == "math":
+            self.display_settings_message("You saved 100% tokens by using SUSTAIN's math optimizer!")
+        elif percentage_saved == 0:
+            self.display_settings_message("With SUSTAIN, you saved 0.00% more tokens compared to traditional AI!\n")
+        else:
+            self.display_settings_message(f"With SUSTAIN, you saved {percentage_saved:.2f}% more tokens compared to traditional AI!\n")
+
+        # Update token savings
+        self.message_count += 1
+        self.total_percentage_saved += percentage_saved
+        average_savings = self.total_percentage_saved / self.message_count
+        self.token_savings_label.config(text=f"Average token savings: {average_savings:.2f}%. Thank you for going green!")
+
+    def on_close(self):
+        """Stop the worker threads and close the window."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.sustain is not None:
+            self.sustain.close()
+        self.root.destroy()
+
     # Function to display a message in the chat area
     def display_message(self, message):
-        self.chat_area.config(state='normal')
-        
+        """Add a message to the transcript and return it, so it can be updated later."""
         # Determine if this is a user or AI message
         if message.startswith("You: "):
-            is_user = True
-            bg_color = "#eaeaea"  # Light grey for user
-            content = message[5:]  # Remove "You: " prefix
-        elif message.startswith("\nSUSTAIN: ") or message.startswith("SUSTAIN: "):
-            is_user = False
-            bg_color = "#99d3ab"  # Light green for AI
-            content = message.replace("\nSUSTAIN: ", "").replace("SUSTAIN: ", "")  # Remove prefix
-        else:
-            # Regular message without special formatting
-            self.chat_area.insert(tk.END, message + "\n")
-            self.chat_area.config(state='disabled')
-            self.chat_area.yview(tk.END)
-            return
-        
-        # Create frame for this message
-        frame = tk.Frame(self.chat_area, bg=self.chat_area["bg"])
-        self.chat_area.window_create(tk.END, window=frame)
-        
-        # Create a frame that will contain both the bubble and the label
-        message_frame = tk.Frame(frame, bg=self.chat_area["bg"])
-        
-        # Calculate width based on content (min 100px, max 70% of chat area width)
-        chat_width = self.chat_area.winfo_width() or 600  # Default if not yet rendered
-        max_width = int(chat_width * 0.7)
-        content_width = min(max(100, len(content) * 8), max_width)
-        
-        # Calculate height based on content
-        line_length = content_width // 10  # Approximate chars per line
-        num_lines = max(1, len(content) // line_length + content.count('\n') + 1)
-        line_height = 24  # Approximate height per line
-        canvas_height = num_lines * line_height + 20  # Add padding
-        
-        # Position the entire message frame to the appropriate side
-        if is_user:
-            message_frame.pack(side=tk.RIGHT, pady=5)
-            frame.pack(fill=tk.X)  # Make the frame take full width
-        else:
-            message_frame.pack(side=tk.LEFT, pady=5)
-            frame.pack(fill=tk.X)  # Make the frame take full width
-        
-        # Create label first
-        if is_user:
-            label = tk.Label(message_frame, font=("Arial", 8), fg="#666666", bg=self.chat_area["bg"])
-            label.pack(side=tk.RIGHT, padx=2, anchor=tk.SE, pady=(0, 5))
-        else:
-            label = tk.Label(message_frame, font=("Arial", 8), fg="#666666", bg=self.chat_area["bg"])
-            label.pack(side=tk.LEFT, padx=2, anchor=tk.SW, pady=(0, 5))
-        
-        # Create canvas after the label so it appears below
-        canvas = tk.Canvas(
-            message_frame, 
-            width=content_width,
-            height=canvas_height,
-            bg=self.chat_area["bg"],
-            highlightthickness=0
-        )
-        
-        # Pack canvas to the appropriate side
-        if is_user:
-            canvas.pack(side=tk.RIGHT, padx=10)  # Add padding to the right side
-        else:
-            canvas.pack(side=tk.LEFT, padx=10)  # Add padding to the left side
-    
-        
-        # Draw a proper rounded rectangle with curved corners only
-        radius = 15  # Radius for corner curvature - adjust as needed
-        
-        # We need a better implementation of rounded rectangle that only rounds the corners
-        # Left-top corner
-        canvas.create_arc(0, 0, 2*radius, 2*radius, start=90, extent=90, fill=bg_color, outline="")
-        # Right-top corner
-        canvas.create_arc(content_width-2*radius, 0, content_width, 2*radius, start=0, extent=90, fill=bg_color, outline="")
-        # Left-bottom corner
-        canvas.create_arc(0, canvas_height-2*radius, 2*radius, canvas_height, start=180, extent=90, fill=bg_color, outline="")
-        # Right-bottom corner
-        canvas.create_arc(content_width-2*radius, canvas_height-2*radius, content_width, canvas_height, start=270, extent=90, fill=bg_color, outline="")
-        
-        # Top edge
-        canvas.create_rectangle(radius, 0, content_width-radius, radius, fill=bg_color, outline="")
-        # Left edge
-        canvas.create_rectangle(0, radius, radius, canvas_height-radius, fill=bg_color, outline="")
-        # Bottom edge
-        canvas.create_rectangle(radius, canvas_height-radius, content_width-radius, canvas_height, fill=bg_color, outline="")
-        # Right edge
-        canvas.create_rectangle(content_width-radius, radius, content_width, canvas_height-radius, fill=bg_color, outline="")
-        
-        # Middle part
-        canvas.create_rectangle(radius, radius, content_width-radius, canvas_height-radius, fill=bg_color, outline="")
-        
-            
-        # Add text inside the bubble
-        canvas.create_text(
-            content_width/2, canvas_height/2,
-            text=content, 
-            width=content_width-20,
-            font=("Mangal_Pro", 14), 
-            fill="black",
-            justify=tk.LEFT  # Always left-align text for readability
-        )
-        
-        # Add a new line after the bubble
-        self.chat_area.insert(tk.END, "\n\n")
-        self.chat_area.config(state='disabled')
-        self.chat_area.yview(tk.END)
-    
+            return self.chat_area.add("user", message[5:])  # Remove "You: " prefix
+        if message.startswith("\nSUSTAIN: ") or message.startswith("SUSTAIN: "):
+            return self.chat_area.add("sustain", message.replace("\nSUSTAIN: ", "").replace("SUSTAIN: ", ""))
+        # Regular message without special formatting
+        return self.chat_area.add("text", message)
+
+    def update_bubble(self, bubble, content):
+        """Replace the text of a bubble returned by display_message."""
+        self.chat_area.update_message(bubble, content)
+
     # Add method to Canvas class for drawing rounded rectangles
     def create_rounded_rectangle(self, canvas, x1, y1, x2, y2, radius=25, **kwargs):
         points = [
@@ -405,15 +396,11 @@ class ChatApp:
 
 # Continue with class methods (properly indented)
     def display_settings_message(self, message):
-        self.chat_area.config(state='normal')
-        self.chat_area.insert(tk.END, message + "\n", "grey")
-        self.chat_area.tag_config("grey", foreground="grey")
-        self.chat_area.config(state='disabled')
-        self.chat_area.yview(tk.END)
+        self.chat_area.add("note", message.strip("\n"))
 
     # Function to save the chat history to a file
     def save_chat(self):
-        chat_history = self.chat_area.get("1.0", tk.END).strip()
+        chat_history = self.chat_area.get_text().strip()
         if chat_history:
             file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
             if file_path:
@@ -423,27 +410,21 @@ class ChatApp:
 
     # Function to clear the chat history
     def clear_chat(self):
-        self.chat_area.config(state='normal')
-        self.chat_area.delete("1.0", tk.END)
-        self.chat_area.config(state='disabled')
+        self.chat_area.clear()
         self.display_settings_message("Chat history cleared.")
 
     # Function to calculate CO2 savings based on token savings
     def calculate_co2_savings(self):
+        if self.sustain is None:
+            self.display_settings_message("SUSTAIN is still starting up, please try again in a moment.")
+            return
+
         kwh_per_token_saved = 0.0001
         co2_per_kwh_saved = 0.7
 
-        total_tokens_saved = 0
-        for msg in self.message_history:
-            original_tokens = self.sustain.count_tokens(msg)
-            optimized_input = self.sustain.text_optimizer.optimize_text(msg)  # Fix: Use text_optimizer to call optimize_text
-            optimized_tokens = self.sustain.count_tokens(optimized_input)
-            tokens_saved = original_tokens - optimized_tokens
-            total_tokens_saved += tokens_saved
-
-            # Assuming the response is capped at 50 tokens
-            response_tokens = 50
-            total_tokens_saved += response_tokens
+        # SUSTAIN keeps a running total of the tokens saved by every answered prompt,
+        # including the ones answered by the math optimizer or from the cache
+        total_tokens_saved = self.sustain.ledger.tokens_saved
 
         total_kwh_saved = total_tokens_saved * kwh_per_token_saved * 365
         total_co2_saved = (total_kwh_saved * co2_per_kwh_saved) / 1_000
@@ -455,6 +436,13 @@ class ChatApp:
         )
         self.display_settings_message(message)
 
+        # Lifetime figures come from the rollups of SUSTAIN's persistent usage log
+        lifetime = self.sustain.usage_log.savings()
+        self.display_settings_message(
+            f"Since you started using SUSTAIN, you have saved {lifetime['tokens_saved']} tokens, "
+            f"about {lifetime['kwh_saved']:.4f} kWh of power and {lifetime['co2_saved_kg']:.4f} kg of CO2."
+        )
+
     def show_info(self):
         """Show information about the chat application."""
         info_window = tk.Toplevel(self.root)
@@ -473,7 +461,8 @@ class ChatApp:
             "How to use:\n"
             "  1. Type your message in the text box at the bottom of the window.\n"
             "  2. Press Enter to send your message to SUSTAIN.\n"
-            "  3. SUSTAIN will respond with an optimized message.\n\n"
+            "  3. SUSTAIN will respond with an optimized message.\n"
+            "  4. Press Esc to stop any answers that are still coming in.\n\n"
 
             "FAQs:\n"
             "What is a token?\n"
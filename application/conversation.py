@@ -0,0 +1,152 @@
+"""
+Description: This module contains multi-turn conversations for SUSTAIN. Recent
+turns are sent verbatim and older ones are folded into a rolling summary, so the
+context sent with each question stays within a token budget. The summary is
+updated incrementally from the turns being folded, and each update is cached.
+
+Messages are always laid out as [summary, older turns..., new question], so the
+start of the history stays the same from one turn to the next until a fold.
+"""
+
+# Import required libraries
+import hashlib
+import logging
+import threading
+from router import Answer
+from log_config import request_context
+
+DEFAULT_CONTEXT_BUDGET = 600  # Tokens of summary and turns sent with each question
+DEFAULT_KEEP_RECENT = 2  # Turns that are never folded into the summary
+SUMMARY_MAX_TOKENS = 120
+CONVERSATION_ROUTE = "conversation"
+
+
+class Turn:
+    """One question and answer, with the tokens it adds to the context."""
+
+    __slots__ = ("question", "answer", "tokens")
+
+    def __init__(self, question, answer, tokens):
+        self.question = question
+        self.answer = answer
+        self.tokens = tokens
+
+
+class Conversation:
+    """A token-budgeted conversation with one SUSTAIN pipeline.
+
+    Turns are answered fresh rather than from the response cache, since the same
+    question can mean something else later in a conversation.
+    """
+
+    def __init__(self, pipeline, budget=DEFAULT_CONTEXT_BUDGET, keep_recent=DEFAULT_KEEP_RECENT):
+        self.pipeline = pipeline
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.summary = ""
+        self.summary_tokens = 0
+        self.turns = []
+        self.context_tokens = 0  # Tokens of the summary and turns currently kept
+        self.history_tokens = 0  # Tokens of every turn as typed, i.e. the cost of resending it all
+        self.summary_usage = [0, 0]  # Prompt and reply tokens of summary requests not yet recorded
+        self.lock = threading.Lock()
+
+    def ask(self, user_input):
+        """Answer the next question with the conversation so far as context. Returns an Answer."""
+        pipeline = self.pipeline
+        with self.lock, request_context():
+            # Arithmetic does not depend on context and is still answered locally
+            if pipeline.math_optimizer.recognize_math(user_input):
+                return pipeline.answer(user_input)
+
+            pipeline.metrics_registry.increment("requests")
+            optimized = pipeline.optimize_prompt(user_input)
+            messages = self.build_messages(optimized.text)
+            response_text = pipeline.api_client.complete(messages)
+
+            model = pipeline.api_client.model
+            response_tokens = pipeline.count_tokens(response_text, model)
+            sent_tokens = self.context_tokens + optimized.optimized_tokens
+            # Compared with resending the whole conversation as typed
+            original_tokens = self.history_tokens + optimized.original_tokens
+            pipeline.router.record(CONVERSATION_ROUTE)
+
+            self.history_tokens += optimized.original_tokens + response_tokens
+            self.add_turn(Turn(optimized.text, response_text, optimized.optimized_tokens + response_tokens))
+            # A summary request made by this turn's fold is paid for out of its savings
+            summary_sent, summary_response = self.summary_usage
+            self.summary_usage = [0, 0]
+            pipeline.record_usage(
+                CONVERSATION_ROUTE, original_tokens, sent_tokens + summary_sent, response_tokens + summary_response
+            )
+            saved = pipeline.calculate_percentage_saved(original_tokens, sent_tokens)
+            return Answer(response_text, saved, CONVERSATION_ROUTE)
+
+    def build_messages(self, question):
+        """Lay out the context as a stable prefix followed by the new question."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far: {self.summary}"})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.answer})
+        messages.extend(self.pipeline.api_client.build_messages(question))
+        return messages
+
+    def add_turn(self, turn):
+        self.turns.append(turn)
+        self.context_tokens += turn.tokens
+        if self.context_tokens > self.budget and len(self.turns) > self.keep_recent:
+            self.fold()
+
+    def fold(self):
+        """Move the oldest turns into the summary until the context fits the budget."""
+        folded = []
+        while self.context_tokens > self.budget and len(self.turns) > self.keep_recent:
+            turn = self.turns.pop(0)
+            self.context_tokens -= turn.tokens
+            folded.append(turn)
+
+        self.context_tokens -= self.summary_tokens
+        self.summary = self.summarize(self.summary, folded)
+        self.summary_tokens = self.pipeline.count_tokens(self.summary, self.pipeline.api_client.model)
+        self.context_tokens += self.summary_tokens
+
+    def summarize(self, summary, turns):
+        """Extend the summary with the folded turns, reusing a cached result for the same update."""
+        exchanges = "\n".join(f"User: {turn.question}\nAssistant: {turn.answer}" for turn in turns)
+        cache = self.pipeline.cache
+        digest = hashlib.sha1(f"{summary}\n{exchanges}".encode("utf-8")).hexdigest()
+        cache_key = f"summary:{self.pipeline.api_client.model}:{digest}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        prompt = (
+            "Update the summary of a conversation with the new exchanges below. Keep the "
+            "facts needed to answer follow-up questions, in under 60 words.\n\n"
+            f"Summary: {summary or '(empty)'}\n\nNew exchanges:\n{exchanges}"
+        )
+        try:
+            updated = self.pipeline.api_client.complete(
+                [{"role": "user", "content": prompt}], SUMMARY_MAX_TOKENS
+            )
+        except Exception as e:
+            # Losing the oldest context is better than failing the question
+            logging.error(f"Failed to update the conversation summary: {str(e)}")
+            return summary
+        model = self.pipeline.api_client.model
+        self.summary_usage[0] += self.pipeline.count_tokens(prompt, model)
+        self.summary_usage[1] += self.pipeline.count_tokens(updated, model)
+        cache.set(cache_key, updated)
+        return updated
+
+    def reset(self):
+        """Forget the conversation."""
+        with self.lock:
+            self.summary = ""
+            self.summary_tokens = 0
+            self.turns = []
+            self.context_tokens = 0
+            self.history_tokens = 0
+            self.summary_usage = [0, 0]
@@ -0,0 +1,66 @@
+"""
+Description: This module contains the token-savings ledger used by SUSTAIN. Each
+answered request adds its exact token counts to a handful of running totals, so
+session savings (and the energy and CO2 figures derived from them) can be read
+at any time without going back over the conversation.
+"""
+
+# Import required libraries
+import threading
+
+# Routes whose answers never reach the API, so the whole request is saved. A
+# coalesced answer is shared from an identical request that did reach it.
+LOCAL_ROUTES = ("math", "faq", "cache", "coalesced")
+
+
+class TokenLedger:
+    """Running totals of the tokens each request would have used and actually used."""
+
+    def __init__(self):
+        self.requests = 0
+        self.original_tokens = 0  # Tokens in the prompts as the user typed them
+        self.sent_tokens = 0  # Optimized prompt tokens actually sent to the API
+        self.response_tokens = 0  # Tokens in the responses, wherever they came from
+        self.tokens_saved = 0
+        self.routes = {}  # route -> [requests, tokens saved]
+        self.lock = threading.Lock()
+
+    def record(self, route, original_tokens, sent_tokens, response_tokens):
+        """Add one answered request. Returns the tokens it saved."""
+        if route in LOCAL_ROUTES:
+            # Answered locally: neither the prompt nor the response went over the API
+            tokens_saved = original_tokens + response_tokens
+        else:
+            tokens_saved = max(original_tokens - sent_tokens, 0)
+
+        with self.lock:
+            self.requests += 1
+            self.original_tokens += original_tokens
+            self.sent_tokens += sent_tokens
+            self.response_tokens += response_tokens
+            self.tokens_saved += tokens_saved
+            totals = self.routes.setdefault(route, [0, 0])
+            totals[0] += 1
+            totals[1] += tokens_saved
+        return tokens_saved
+
+    def percentage_saved(self):
+        """Percentage of prompt and response tokens that never had to go over the API."""
+        with self.lock:
+            total = self.original_tokens + self.response_tokens
+            return self.tokens_saved / total * 100 if total else 0.0
+
+    def snapshot(self):
+        """Return the totals as plain data."""
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "original_tokens": self.original_tokens,
+                "sent_tokens": self.sent_tokens,
+                "response_tokens": self.response_tokens,
+                "tokens_saved": self.tokens_saved,
+                "routes": {
+                    route: {"requests": requests, "tokens_saved": tokens_saved}
+                    for route, (requests, tokens_saved) in self.routes.items()
+                },
+            }
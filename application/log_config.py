@@ -0,0 +1,120 @@
+"""
+Description: This module sets up logging for the SUSTAIN entry points. Log calls
+only put the record on an in-memory queue; a background listener thread formats
+each record as one JSON line and writes it to a size-rotated log file. Records
+carry the ID of the request they belong to, and stage timings can be logged too.
+"""
+
+# Import required libraries
+import os
+import json
+import queue
+import uuid
+import atexit
+import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DEFAULT_LOG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../sustain.log'))
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024  # Rotate the log at 5 MB
+DEFAULT_BACKUP_COUNT = 3
+
+# The request being handled by the current thread or asyncio task
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+_listener = None
+_queue_handler = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request ID. Runs in the thread that logged them."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON object per line."""
+
+    # Extra fields copied into the JSON when a log call passes them
+    EXTRA_FIELDS = ("stage", "seconds", "route")
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        for field in self.EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(path=DEFAULT_LOG_PATH, level=None, max_bytes=DEFAULT_MAX_BYTES,
+                      backup_count=DEFAULT_BACKUP_COUNT):
+    """Route the root logger through a queue to a rotating JSON log file. Safe to call more than once."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    if level is None:
+        level = os.getenv("SUSTAIN_LOG_LEVEL", "INFO").upper()
+
+    file_handler = RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    _queue_handler = QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+
+    _listener = QueueListener(_queue_handler.queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)  # Write out what is still queued on exit
+    return _listener
+
+
+def shutdown_logging():
+    """Stop the background writer after it has written every queued record."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
+
+
+@contextmanager
+def request_context(request_id=None):
+    """Tag log records made inside the block with a request ID.
+
+    A block nested in another request's block keeps the outer ID unless it is given its own.
+    """
+    if request_id is None:
+        request_id = request_id_var.get() or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        yield request_id
+    finally:
+        request_id_var.reset(token)
+
+
+def log_stage_timing(stage, seconds):
+    """Metrics sink that logs each pipeline stage timing at DEBUG level."""
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"{stage} took {seconds * 1000:.2f} ms", extra={"stage": stage, "seconds": seconds})
@@ -6,25 +6,47 @@ Description: This file is responsible for running the chat application.
 # Import required libraries
 import os
 import logging
+import threading
 import tkinter as tk
 from dotenv import load_dotenv
 from chat_gui import ChatApp
-import spacy
+from log_config import configure_logging
 import platform
 
-# Configure logging
-log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../sustain.log'))
-logging.basicConfig(filename=log_file_path, level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging. Records are written to ../sustain.log by a background thread
+configure_logging()
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Function to track the token length of a message
+# Set once prepare_nlp has loaded the spaCy model
+nlp_ready = threading.Event()
+
+# Function to track the token length of a message. It is called on the Tk thread,
+# so it is skipped until the model has been loaded in the background.
 def track_token_length(message):
-    nlp = spacy.load("en_core_web_sm")
-    doc = nlp(message)
+    if not nlp_ready.is_set():
+        return None
+    from sustain import get_nlp
+    doc = get_nlp().make_doc(message)
     return len(doc)
 
+# Function to make sure the spaCy model is installed and loaded. It runs on a
+# background thread, so importing spaCy does not delay the first window.
+def prepare_nlp():
+    try:
+        import spacy
+        from sustain import get_nlp, SPACY_MODEL
+
+        # Check if spaCy model is installed, if not, download it
+        if not spacy.util.is_package(SPACY_MODEL):
+            from spacy.cli import download
+            download(SPACY_MODEL)
+        get_nlp()
+        nlp_ready.set()
+    except Exception as e:
+        logging.error(f"Failed to prepare the spaCy model: {str(e)}")
+
 # Main function to run the chat application
 def main():
     logging.info("Starting SUSTAIN Chat Application")
@@ -67,12 +89,8 @@ def main():
             "API key not found. Please set the OPENAI_API_KEY environment variable."
         )
 
-    # Check if spaCy model is installed, if not, download it
-    try:
-        spacy.load("en_core_web_sm")
-    except OSError:
-        from spacy.cli import download
-        download("en_core_web_sm")
+    # Load the shared spaCy model in the background so the first message does not wait
+    threading.Thread(target=prepare_nlp, daemon=True).start()
 
     app = ChatApp(root, track_token_length)
     root.mainloop()
@@ -0,0 +1,153 @@
+"""
+Description: This module contains the lightweight metrics used to see where time
+goes inside SUSTAIN. Stage timers feed fixed-bucket latency histograms, counters
+track events such as cache hits and API errors, and snapshots can be exported as
+JSON or in the Prometheus text format. Callers can attach their own timing sinks.
+"""
+
+# Import required libraries
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from 0.1 ms up to 30 s
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram; observing a value is a binary search and an increment."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts values above every bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Return the count, sum and cumulative bucket counts."""
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float('inf') else repr(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class Metrics:
+    """Stage latency histograms and event counters for one SUSTAIN pipeline."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.sinks = []
+        self.lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        """Add to a counter, optionally split by labels (e.g. answerer="math")."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value):
+        """Record the current value of something that goes up and down, e.g. a queue depth."""
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, stage, seconds):
+        """Record how long one run of a stage took and pass it on to the sinks."""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        for sink in self.sinks:
+            try:
+                sink(stage, seconds)
+            except Exception as e:
+                logging.error(f"Metrics sink failed: {str(e)}")
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as one run of the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def add_sink(self, sink):
+        """Call sink(stage, seconds) for every timing recorded from now on."""
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def snapshot(self):
+        """Return every counter and stage histogram as plain data."""
+        with self.lock:
+            return {
+                "counters": {
+                    self.format_key(name, labels): value
+                    for (name, labels), value in sorted(self.counters.items())
+                },
+                "gauges": dict(sorted(self.gauges.items())),
+                "stages": {
+                    stage: histogram.snapshot()
+                    for stage, histogram in sorted(self.histograms.items())
+                },
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="sustain"):
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = [(stage, histogram.snapshot()) for stage, histogram in sorted(self.histograms.items())]
+
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{prefix}_{name}_total"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{self.format_key(metric, labels)} {value}")
+
+        for name, value in gauges:
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+
+        if histograms:
+            metric = f"{prefix}_stage_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for stage, snapshot in histograms:
+                for bound, count in snapshot["buckets"].items():
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {snapshot["sum"]}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {snapshot["count"]}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_key(name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
@@ -0,0 +1,158 @@
+"""
+Description: This module picks how long an API response may be. Prompts are
+sorted into a few query classes (yes/no questions, definitions, lists,
+explanations), and each class gets its own instructions, post-processor and
+max_tokens. The max_tokens of a class follows the lengths of its recent
+completions, so short answers are not given room they never use and long ones
+are not cut off.
+"""
+
+# Import required libraries
+import re
+import math
+import threading
+from collections import deque, namedtuple
+
+# (class, instruction appended to the prompt, starting max_tokens, post-processor).
+# Post-processors are named after the TextOptimizer response helpers; explanations
+# are left as written, since cutting them down loses the reasoning that was asked for.
+QUERY_CLASSES = (
+    ("list", "as a comma-separated list of up to 3 items.", 40, "truncate_list"),
+    ("yes_no", "Answer yes or no with a short reason, in <20 words.", 24, "trim_response"),
+    ("definition", "in <20 words.", 40, "trim_response"),
+    ("explanation", "in <40 words.", 70, None),
+)
+
+# (class, pattern), tried in order; the first match wins. A prompt only counts as
+# a list request when it starts by asking for one, or mentions "types of" and the
+# like without already being a what/how question ("What is a linked list?").
+CLASS_PATTERNS = (
+    ("list", re.compile(
+        r"^(?:list|name \d+|give me \d+|top \d+|\d+ (?:things|ways|reasons|examples|tips))\b", re.IGNORECASE
+    )),
+    ("yes_no", re.compile(
+        r"^(?:is|are|am|was|were|do|does|did|can|could|should|would|will|has|have|had)\b", re.IGNORECASE
+    )),
+    ("definition", re.compile(
+        r"^(?:what(?:'s| is| are| was)|who(?:'s| is| are| was)|define|meaning of|definition of)\b", re.IGNORECASE
+    )),
+    ("explanation", re.compile(
+        r"^(?:why|how|explain|describe|compare)\b|\b(?:difference between|compared to)\b", re.IGNORECASE
+    )),
+    ("list", re.compile(
+        r"\b(?:examples of|types of|kinds of|ways to|tips for|top \d+|\d+ (?:things|ways|reasons|examples|tips))\b",
+        re.IGNORECASE
+    )),
+)
+GENERAL_CLASS = "general"
+
+DEFAULT_WINDOW = 200  # Recent completions kept per class
+DEFAULT_MIN_SAMPLES = 20  # Completions needed before a class moves off its starting budget
+DEFAULT_QUANTILE = 0.9
+HEADROOM = 1.1
+MIN_MAX_TOKENS = 16
+MAX_MAX_TOKENS = 150
+# A cut-off completion was at least this much longer than its limit
+TRUNCATED_LENGTH_FACTOR = 1.5
+
+# The class of a prompt and how it is sent
+ResponsePlan = namedtuple('ResponsePlan', ['query_class', 'messages', 'max_tokens'])
+
+
+class QueryClass:
+    """Settings and recent completion lengths of one query class."""
+
+    def __init__(self, name, instruction, max_tokens, post_processor, window):
+        self.name = name
+        self.instruction = instruction
+        self.max_tokens = max_tokens
+        self.post_processor = post_processor
+        self.lengths = deque(maxlen=window)
+        self.completions = 0
+        self.truncated = 0
+
+
+class ResponseBudget:
+    """Chooses the instructions, max_tokens and post-processor for each prompt's response."""
+
+    def __init__(self, optimizer, default_max_tokens=50, window=DEFAULT_WINDOW,
+                 min_samples=DEFAULT_MIN_SAMPLES, quantile=DEFAULT_QUANTILE, metrics=None):
+        # optimizer provides the response helpers named in QUERY_CLASSES
+        self.patterns = CLASS_PATTERNS
+        self.classes = {}
+        for name, instruction, max_tokens, post_processor in QUERY_CLASSES:
+            if post_processor is not None:
+                post_processor = getattr(optimizer, post_processor)
+            self.classes[name] = QueryClass(name, instruction, max_tokens, post_processor, window)
+        self.classes[GENERAL_CLASS] = QueryClass(GENERAL_CLASS, "in <20 words.", default_max_tokens, None, window)
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.metrics = metrics
+        self.lock = threading.Lock()
+
+    def classify(self, prompt):
+        """Return the name of the query class a prompt belongs to."""
+        prompt = prompt.strip()
+        for name, pattern in self.patterns:
+            if pattern.search(prompt):
+                return name
+        return GENERAL_CLASS
+
+    def plan(self, prompt):
+        """Return the ResponsePlan for a prompt."""
+        query_class = self.classes[self.classify(prompt)]
+        messages = [{"role": "user", "content": f"{prompt} {query_class.instruction}"}]
+        with self.lock:
+            return ResponsePlan(query_class.name, messages, query_class.max_tokens)
+
+    def post_process(self, prompt, text):
+        """Apply the post-processor of the prompt's class to a response.
+
+        Responses are cached as the API returned them, so this runs each time one is given out.
+        """
+        post_processor = self.classes[self.classify(prompt)].post_processor
+        return post_processor(text) if post_processor is not None else text
+
+    def record(self, plan, completion_tokens, finish_reason):
+        """Add a completion's length to its class and update the class's max_tokens."""
+        query_class = self.classes[plan.query_class]
+        truncated = finish_reason == "length"
+        length = completion_tokens
+        if truncated:
+            # The answer was cut off, so all we know is that it wanted more room
+            length = max(completion_tokens, plan.max_tokens) * TRUNCATED_LENGTH_FACTOR
+
+        with self.lock:
+            query_class.completions += 1
+            query_class.truncated += truncated
+            query_class.lengths.append(length)
+            if len(query_class.lengths) >= self.min_samples:
+                query_class.max_tokens = self.budget_for(query_class.lengths)
+            max_tokens = query_class.max_tokens
+
+        if self.metrics is not None:
+            self.metrics.increment("completion_tokens", completion_tokens, query_class=plan.query_class)
+            if truncated:
+                self.metrics.increment("completions_truncated", query_class=plan.query_class)
+            self.metrics.set_gauge(f"max_tokens_{plan.query_class}", max_tokens)
+
+    def budget_for(self, lengths):
+        """Leave room for all but the longest few recent completions, with some headroom."""
+        ordered = sorted(lengths)
+        index = min(int(len(ordered) * self.quantile), len(ordered) - 1)
+        budget = math.ceil(ordered[index] * HEADROOM)
+        return min(max(budget, MIN_MAX_TOKENS), MAX_MAX_TOKENS)
+
+    def stats(self):
+        """Return the current max_tokens and truncation rate of each class."""
+        with self.lock:
+            return {
+                name: {
+                    "max_tokens": query_class.max_tokens,
+                    "completions": query_class.completions,
+                    "truncation_rate": (
+                        query_class.truncated / query_class.completions if query_class.completions else 0.0
+                    ),
+                }
+                for name, query_class in self.classes.items()
+            }
@@ -0,0 +1,205 @@
+"""
+Description: This module contains the query router used by SUSTAIN. A prompt is
+offered to an ordered list of answerers (math, canned answers, the cache and
+finally the API) and the first one that can answer it wins. Every answerer has a
+cheap pre-filter, so most prompts skip the expensive checks of answerers that
+could never handle them.
+"""
+
+# Import required libraries
+import threading
+from collections import Counter, namedtuple
+from functools import cached_property
+from metrics import Metrics
+
+# The result of routing a prompt: the response, its token savings and who answered
+Answer = namedtuple('Answer', ['text', 'percentage_saved', 'route'])
+
+# Route of an answer shared from an identical request that was already in flight
+COALESCED_ROUTE = "coalesced"
+
+
+class Query:
+    """A prompt being routed. Derived values are only computed when an answerer needs them."""
+
+    def __init__(self, pipeline, user_input):
+        self.pipeline = pipeline
+        self.user_input = user_input
+
+    @cached_property
+    def normalized(self):
+        """The prompt lowercased, with whitespace and edge punctuation normalized."""
+        return self.pipeline.text_optimizer.normalize(self.user_input)
+
+    @cached_property
+    def optimized(self):
+        """The OptimizedPrompt: optimized text, token counts and percentage saved."""
+        return self.pipeline.optimize_prompt(self.user_input)
+
+    @property
+    def optimized_input(self):
+        return self.optimized.text
+
+    @property
+    def percentage_saved(self):
+        return self.optimized.percentage_saved
+
+    @cached_property
+    def original_tokens(self):
+        """Tokens in the prompt as typed, reusing the count from optimization when there was one."""
+        if "optimized" in self.__dict__:
+            return self.optimized.original_tokens
+        return self.pipeline.count_tokens(self.user_input, self.pipeline.api_client.model)
+
+    @cached_property
+    def cache_key(self):
+        return self.pipeline.cache_key(self.optimized_input)
+
+
+class Answerer:
+    """One stage of the router. Subclasses set a name and implement answer()."""
+
+    name = None
+    local = True  # False for answerers that make network calls
+    metrics = None  # Set by the QueryRouter the answerer belongs to
+
+    def prefilter(self, query):
+        """Cheaply decide whether answer() is worth trying. Must be O(1) or precompiled."""
+        return True
+
+    def answer(self, query):
+        """Return an Answer, or None to pass the query on to the next answerer."""
+        raise NotImplementedError
+
+
+class MathAnswerer(Answerer):
+    """Solves arithmetic prompts locally, saving every token."""
+
+    name = "math"
+
+    def __init__(self, math_optimizer):
+        self.math_optimizer = math_optimizer
+
+    def prefilter(self, query):
+        return self.math_optimizer.might_be_math(query.user_input)
+
+    def answer(self, query):
+        with self.metrics.timer("math"):
+            if not self.math_optimizer.recognize_math(query.user_input):
+                return None
+            return Answer(self.math_optimizer.solve_math(query.user_input), 100, self.name)
+
+
+class FAQAnswerer(Answerer):
+    """Answers known questions with canned responses."""
+
+    name = "faq"
+
+    def __init__(self, text_optimizer, answers):
+        self.answers = {text_optimizer.normalize(question): text for question, text in answers.items()}
+
+    def prefilter(self, query):
+        return query.normalized in self.answers
+
+    def answer(self, query):
+        return Answer(self.answers[query.normalized], 0, self.name)
+
+
+class CacheAnswerer(Answerer):
+    """Serves responses already fetched for an equivalent prompt."""
+
+    name = "cache"
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def answer(self, query):
+        cache_key = query.cache_key
+        with self.metrics.timer("cache_lookup"):
+            cached = self.cache.get(cache_key)
+        if cached is None:
+            self.metrics.increment("cache_misses")
+            return None
+        self.metrics.increment("cache_hits")
+        return Answer(cached, query.percentage_saved, self.name)
+
+
+class APIAnswerer(Answerer):
+    """Sends the optimized prompt to the OpenAI API and caches the response.
+
+    Identical prompts that arrive while a call is in flight wait for that call
+    instead of making their own.
+    """
+
+    name = "api"
+    local = False
+
+    def __init__(self, api_client, cache, flights):
+        self.api_client = api_client
+        self.cache = cache
+        self.flights = flights
+
+    def answer(self, query):
+        (response_text, route), shared = self.flights.do(query.cache_key, lambda: self.fetch(query))
+        return Answer(response_text, query.percentage_saved, COALESCED_ROUTE if shared else route)
+
+    def fetch(self, query):
+        """Return (response, route), checking the cache again in case a call just filled it."""
+        cached = self.cache.get(query.cache_key)
+        if cached is not None:
+            return cached, CacheAnswerer.name
+        with self.metrics.timer("api"):
+            try:
+                response_text = self.api_client.get_openai_response(query.optimized_input)
+            except Exception:
+                self.metrics.increment("api_errors")
+                raise
+        self.cache.set(query.cache_key, response_text)
+        return response_text, self.name
+
+
+class QueryRouter:
+    """Offers each query to the answerers in order and counts the routing decisions."""
+
+    def __init__(self, answerers, metrics=None):
+        self.answerers = list(answerers)
+        self.metrics = metrics if metrics is not None else Metrics()
+        for answerer in self.answerers:
+            answerer.metrics = self.metrics
+        self.routes = Counter()  # Queries answered by each answerer
+        self.skipped = Counter()  # Queries rejected by each answerer's pre-filter
+        self.declined = Counter()  # Queries that passed the pre-filter but were not answered
+        self.lock = threading.Lock()
+
+    def route(self, query, local_only=False):
+        """Return the first answer for the query, or None if only local answerers may run and none answered."""
+        for answerer in self.answerers:
+            if local_only and not answerer.local:
+                continue
+            if not answerer.prefilter(query):
+                self.count(self.skipped, answerer.name, "skipped")
+                continue
+            answer = answerer.answer(query)
+            if answer is not None:
+                self.count(self.routes, answer.route, "answered")
+                return answer
+            self.count(self.declined, answerer.name, "declined")
+        return None
+
+    def record(self, name):
+        """Count a query that was answered outside route(), e.g. by a streaming API call."""
+        self.count(self.routes, name, "answered")
+
+    def count(self, counter, name, decision):
+        with self.lock:
+            counter[name] += 1
+        self.metrics.increment("routing_decisions", answerer=name, decision=decision)
+
+    def stats(self):
+        """Return the routing counters for each answerer."""
+        with self.lock:
+            return {
+                "routes": dict(self.routes),
+                "skipped": dict(self.skipped),
+                "declined": dict(self.declined),
+            }
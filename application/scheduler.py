@@ -0,0 +1,188 @@
+"""
+Description: This module contains the rate-limit aware scheduler that sits in
+front of SUSTAIN's OpenAI calls. Requests are admitted through token buckets for
+requests per minute and tokens per minute, in arrival order, so bursts queue up
+instead of running into the API's limits. Rate-limited, server and connection
+errors are retried with jittered exponential backoff, and a 429 pauses admission
+for everyone so retries do not turn into an error storm.
+"""
+
+# Import required libraries
+import time
+import random
+import asyncio
+import logging
+import threading
+from openai import RateLimitError, APIStatusError, APIConnectionError
+
+DEFAULT_REQUESTS_PER_MINUTE = 3500
+DEFAULT_TOKENS_PER_MINUTE = 90000
+
+
+class TokenBucket:
+    """A token bucket that hands out reservations, so waiting callers are served in arrival order.
+
+    Reserving always succeeds and may take the bucket below zero; the caller then
+    waits until the bucket has refilled past its reservation.
+    """
+
+    def __init__(self, per_minute, burst_seconds=10):
+        self.rate = per_minute / 60  # Units added per second
+        self.capacity = max(self.rate * burst_seconds, 1)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """Take amount from the bucket and return how many seconds to wait before using it."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(-self.level / self.rate, 0.0)
+
+    def refund(self, amount):
+        """Give back a reservation that was never used."""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimitScheduler:
+    """Admits API calls within requests-per-minute and tokens-per-minute budgets and retries transient failures."""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, max_retries=5,
+                 base_delay=0.5, max_delay=30.0, metrics=None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self.paused_until = 0.0  # Set when the API answers 429
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def run(self, function, estimated_tokens):
+        """Call function() once admitted, retrying transient API errors. Blocks the calling thread."""
+        for attempt in range(self.max_retries + 1):
+            self.wait(self.admit(estimated_tokens), estimated_tokens, time.sleep)
+            try:
+                return function()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def run_async(self, function, estimated_tokens):
+        """Await function() once admitted, retrying transient API errors."""
+        for attempt in range(self.max_retries + 1):
+            delay = self.admit(estimated_tokens)
+            try:
+                await self.wait_async(delay)
+            except asyncio.CancelledError:
+                self.release(estimated_tokens)
+                raise
+            try:
+                return await function()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def admit(self, estimated_tokens):
+        """Reserve budget for one request and return how long it has to queue."""
+        with self.lock:
+            now = time.monotonic()
+            delay = max(
+                self.requests.reserve(1, now),
+                self.tokens.reserve(estimated_tokens, now),
+                self.paused_until - now,
+            )
+            if delay > 0:
+                self.waiting += 1
+            return delay
+
+    def release(self, estimated_tokens):
+        """Return the budget of a request that gave up while queued."""
+        with self.lock:
+            self.waiting -= 1
+            self.requests.refund(1)
+            self.tokens.refund(estimated_tokens)
+
+    def wait(self, delay, estimated_tokens, sleep):
+        if delay <= 0:
+            return
+        self.observe_wait(delay)
+        try:
+            sleep(delay)
+        except BaseException:
+            self.release(estimated_tokens)
+            raise
+        with self.lock:
+            self.waiting -= 1
+
+    async def wait_async(self, delay):
+        if delay <= 0:
+            return
+        self.observe_wait(delay)
+        await asyncio.sleep(delay)
+        with self.lock:
+            self.waiting -= 1
+
+    def retry_delay(self, error, attempt):
+        """Return how long to wait before retrying after the error, or None if it should not be retried."""
+        if isinstance(error, RateLimitError):
+            # An exhausted quota is also a 429, but waiting will not fix it
+            if getattr(error, "code", None) == "insufficient_quota":
+                return None
+            status = 429
+        elif isinstance(error, APIStatusError) and error.status_code >= 500:
+            status = error.status_code
+        elif isinstance(error, APIConnectionError):
+            status = None
+        else:
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        # Full jitter keeps retrying clients from moving in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if status == 429:
+            # Everyone else is about to hit the same limit, so hold back all admissions
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+        logging.warning(f"Retrying OpenAI request in {delay:.2f}s after: {str(error)}")
+        if self.metrics is not None:
+            self.metrics.increment("api_retries", status=status or "connection")
+        return delay
+
+    @staticmethod
+    def retry_after(error):
+        """Read the Retry-After header of an error response, in seconds."""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    def observe_wait(self, delay):
+        if self.metrics is not None:
+            self.metrics.observe("queue_wait", delay)
+
+    def queue_depth(self):
+        """Return how many requests are currently queued for admission."""
+        with self.lock:
+            return self.waiting
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.waiting,
+                "paused_for": max(self.paused_until - time.monotonic(), 0.0),
+            }
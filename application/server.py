@@ -0,0 +1,168 @@
+'''
+Description: This file runs SUSTAIN as a headless HTTP service so web and mobile
+frontends can share one optimization pipeline. Every request handler uses the same
+SUSTAIN instance, and with it the same optimizer, tokenizer and response cache.
+
+Endpoints (all POST bodies are JSON objects with a "text" field):
+    POST /optimize  Optimize a prompt and report its token savings
+    POST /math      Solve a math prompt locally, if it is one
+    POST /answer    Answer a prompt through the full SUSTAIN pipeline
+    GET  /health    Report that the service is up
+    GET  /metrics   Pipeline metrics in the Prometheus text format (JSON with ?format=json)
+
+Usage:
+    python server.py --host 127.0.0.1 --port 8000 --workers 8
+'''
+
+# Import required libraries
+import os
+import json
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from sustain import SUSTAIN
+from log_config import configure_logging, request_context
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class SustainRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests from the same client
+    protocol_version = "HTTP/1.1"
+    server_version = "SUSTAIN"
+    timeout = 30  # Close idle keep-alive connections after this many seconds
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self.send_text(200, self.server.sustain.export_metrics("prometheus"))
+        elif self.path == "/metrics?format=json":
+            self.send_json(200, self.server.sustain.metrics())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        routes = {
+            "/optimize": self.handle_optimize,
+            "/math": self.handle_math,
+            "/answer": self.handle_answer,
+        }
+        handler = routes.get(self.path)
+        body = self.read_json()
+        if handler is None:
+            self.send_json(404, {"error": "Not found"})
+            return
+        if not isinstance(body, dict) or not isinstance(body.get("text"), str):
+            self.send_json(400, {"error": "Expected a JSON object with a \"text\" string"})
+            return
+
+        # Bound how many requests run through the pipeline at once. Log records are
+        # tagged with the caller's X-Request-ID, or a new ID if it did not send one.
+        with self.server.workers, request_context(self.headers.get("X-Request-ID")):
+            try:
+                payload = handler(body["text"])
+            except Exception as e:
+                logging.error(f"Request to {self.path} failed: {str(e)}")
+                self.send_json(500, {"error": str(e)})
+                return
+        self.send_json(200, payload)
+
+    def handle_optimize(self, text):
+        sustain = self.server.sustain
+        rule_savings = {}
+        optimized = sustain.text_optimizer.optimize_text(text, rule_savings)
+        original_tokens, optimized_tokens = sustain.count_tokens_many(
+            [text, optimized], sustain.api_client.model
+        )
+        return {
+            "optimized": optimized,
+            "original_tokens": original_tokens,
+            "optimized_tokens": optimized_tokens,
+            "percentage_saved": sustain.calculate_percentage_saved(original_tokens, optimized_tokens),
+            "rule_savings": rule_savings,
+        }
+
+    def handle_math(self, text):
+        result = self.server.sustain.answer_math(text)
+        return {"math": result is not None, "result": result}
+
+    def handle_answer(self, text):
+        response, percentage_saved = self.server.sustain.get_response(text)
+        return {"response": response, "percentage_saved": percentage_saved}
+
+    def read_json(self):
+        """Read the request body, which must be consumed to keep the connection usable."""
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length > 0 else b""
+        try:
+            return json.loads(raw or b"null")
+        except ValueError:
+            return None
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def send_text(self, status, text):
+        self.send_body(status, text.encode("utf-8"), "text/plain; version=0.0.4")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Called for every request, so skip formatting when INFO is not logged
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("%s - %s", self.address_string(), format % args)
+
+
+class SustainServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, sustain, workers=8):
+        super().__init__(address, SustainRequestHandler)
+        self.sustain = sustain
+        self.workers = threading.BoundedSemaphore(workers)
+
+
+# Main function to run the SUSTAIN service
+def main():
+    parser = argparse.ArgumentParser(description="Run SUSTAIN as an HTTP service.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--workers", type=int, default=8,
+        help="Maximum number of requests processed at the same time"
+    )
+    args = parser.parse_args()
+    configure_logging()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError(
+            "API key not found. Please set the OPENAI_API_KEY environment variable."
+        )
+
+    sustain = SUSTAIN(api_key=api_key)
+    server = SustainServer((args.host, args.port), sustain, args.workers)
+    logging.info(f"Starting SUSTAIN service on {args.host}:{args.port}")
+    print(f"SUSTAIN service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sustain.close()
+
+
+# Run the main function
+if __name__ == "__main__":
+    main()
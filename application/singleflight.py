@@ -0,0 +1,107 @@
+"""
+Description: This module contains the request coalescing used by SUSTAIN. While a
+call for a key is in flight, other callers asking for the same key wait for its
+result instead of making their own call. It works for threads and for asyncio
+tasks, and an error raised by the call is raised in every caller waiting on it.
+"""
+
+# Import required libraries
+import asyncio
+import threading
+
+# Seconds a caller waits on an identical request before giving up on it
+DEFAULT_WAIT_TIMEOUT = 300
+
+
+class Flight:
+    """One in-flight call that any number of callers can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        """Block until the call finishes, then return its result or raise its error."""
+        if not self.event.wait(timeout):
+            raise TimeoutError("Timed out waiting for an identical request to finish")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into a single call."""
+
+    def __init__(self, metrics=None, timeout=DEFAULT_WAIT_TIMEOUT):
+        self.metrics = metrics
+        self.timeout = timeout
+        self.flights = {}  # key -> Flight, for threads
+        self.futures = {}  # (event loop, key) -> Future, for asyncio tasks
+        self.lock = threading.Lock()
+
+    def join(self, key):
+        """Return (flight, leader). The leader must call finish(); everyone else waits on the flight."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                return flight, True
+        self.count_coalesced()
+        return flight, False
+
+    def finish(self, key, flight, result=None, error=None):
+        """Hand the leader's result, or error, to every caller waiting on the flight."""
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.result = result
+        flight.error = error
+        flight.event.set()
+
+    def do(self, key, function):
+        """Call function() unless an identical call is in flight. Returns (result, shared)."""
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait(self.timeout), True
+        try:
+            result = function()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result, False
+
+    async def do_async(self, key, function):
+        """Await function() unless an identical call is in flight. Returns (result, shared)."""
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        future = self.futures.get(flight_key)
+        if future is not None:
+            self.count_coalesced()
+            # Shielded so a waiter being cancelled does not cancel the leader's call
+            return await asyncio.shield(future), True
+
+        future = self.futures[flight_key] = loop.create_future()
+        try:
+            result = await function()
+        except BaseException as e:
+            del self.futures[flight_key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Mark it retrieved; the leader raises it itself
+            raise
+        del self.futures[flight_key]
+        future.set_result(result)
+        return result, False
+
+    def count_coalesced(self):
+        if self.metrics is not None:
+            self.metrics.increment("coalesced_requests")
+
+    def in_flight(self):
+        """Return how many distinct calls are currently in flight."""
+        with self.lock:
+            return len(self.flights) + len(self.futures)
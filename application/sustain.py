@@ -7,48 +7,489 @@ before sending the input to the OpenAI API.
 
 # Import required libraries
 import os
+import ast
+import json
+import asyncio
+import functools
+import contextlib
+import operator
 import logging
-from openai import OpenAI
-import spacy
+import httpx
+from openai import OpenAI, AsyncOpenAI, OpenAIError
 import tiktoken
 import re
-from word2number import w2n
-
-# Configure logging
-logging.basicConfig(
-    filename='../sustain.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+import threading
+import time
+from collections import namedtuple
+from batching import MicroBatcher
+from conversation import Conversation, DEFAULT_CONTEXT_BUDGET, DEFAULT_KEEP_RECENT
+from cache import TieredCache, SQLiteCache, DEFAULT_CACHE_PATH
+from ledger import TokenLedger
+from response_budget import ResponseBudget
+from log_config import request_context, log_stage_timing
+from metrics import Metrics
+from scheduler import RateLimitScheduler, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+from singleflight import SingleFlight
+from usage_log import UsageLog, DEFAULT_USAGE_LOG_PATH
+from router import (
+    Query, QueryRouter, MathAnswerer, FAQAnswerer, CacheAnswerer, APIAnswerer, COALESCED_ROUTE
 )
 
 
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_ENCODING = "cl100k_base"
+MIN_THREADED_BATCH = 64  # Smaller batches are encoded on the calling thread
+SPACY_MODEL = "en_core_web_sm"
+
+# Only spaCy's tokenizer is used, so the rest of the pipeline is never loaded
+SPACY_EXCLUDED_COMPONENTS = [
+    "tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"
+]
+
+# Questions SUSTAIN answers itself without calling the API
+FAQ_ANSWERS = {
+    "What is SUSTAIN?": (
+        "I am SUSTAIN, an environmentally-friendly, token-optimized AI wrapper designed to reduce compute costs "
+        "and increase productivity. I filter out irrelevant words and phrases from prompts and limit responses to "
+        "essential outputs, minimizing the number of tokens used."
+    ),
+}
+
+# Shared spaCy model, loaded on first use
+_nlp = None
+_nlp_lock = threading.Lock()
+
+# Process-wide tokenizer registry so each encoding is only loaded once
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model=DEFAULT_MODEL):
+    """Return the shared tiktoken encoding for a model, loading it on first use."""
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            try:
+                encoding_name = tiktoken.encoding_for_model(model).name
+            except KeyError:
+                encoding_name = DEFAULT_ENCODING
+            # Models sharing an encoding share one instance
+            encoding = _encodings.get(encoding_name)
+            if encoding is None:
+                encoding = tiktoken.get_encoding(encoding_name)
+                _encodings[encoding_name] = encoding
+            _encodings[model] = encoding
+    return encoding
+
+
+def get_nlp():
+    """Return the shared spaCy model, loading it on first use."""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                _nlp = spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDED_COMPONENTS)
+    return _nlp
+
+
+class APIRequestError(Exception):
+    """An OpenAI request failed. The message is suitable for showing to the user."""
+
+
+# One API completion with the usage details the response budget learns from
+Completion = namedtuple('Completion', ['text', 'completion_tokens', 'finish_reason'])
+
+
 class OpenAIClient:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, model=DEFAULT_MODEL, max_connections=20, metrics=None,
+                 base_url=None, scheduler=None, max_tokens=50, response_budget=None):
+        self.api_key = api_key
+        # base_url points the client at another server, e.g. a local stub for testing.
+        # Retries are left to the scheduler, which also knows about the rate limits.
+        self.base_url = base_url
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_connections = max_connections
+        self.metrics = metrics
+        if scheduler is None:
+            scheduler = RateLimitScheduler(
+                requests_per_minute=int(os.getenv("SUSTAIN_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+                tokens_per_minute=int(os.getenv("SUSTAIN_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)),
+                metrics=metrics
+            )
+        self.scheduler = scheduler
+        # Picks max_tokens and the post-processor for each prompt; max_tokens above
+        # stays the default for prompts that fit no class and for raw completions
+        if response_budget is None:
+            response_budget = ResponseBudget(TextOptimizer, max_tokens, metrics=metrics)
+        self.response_budget = response_budget
+
+        # The async client holds a connection pool bound to one event loop, so it
+        # is created lazily and rebuilt if a different loop starts using it
+        self.async_client = None
+        self.async_loop = None
+        self.async_sessions = {}  # event loop -> batch calls currently using the client
+
+    @staticmethod
+    def build_messages(user_input):
+        """Build the chat messages sent for a prompt."""
+        return [{"role": "user", "content": f"{user_input} in <20 words."}]
+
+    def estimate_tokens(self, messages, max_tokens=None):
+        """Estimate the tokens a request uses against the rate limit: the prompt plus the longest reply."""
+        prompt = "".join(message["content"] for message in messages)
+        return SUSTAIN.count_tokens(prompt, self.model) + (max_tokens or self.max_tokens)
 
     def get_openai_response(self, user_input):
+        plan = self.response_budget.plan(user_input)
+        completion = self.create_completion(plan.messages, plan.max_tokens)
+        self.response_budget.record(plan, completion.completion_tokens, completion.finish_reason)
+        return completion.text
+
+    def complete(self, messages, max_tokens=None):
+        """Send chat messages through the scheduler and return the reply text."""
+        return self.create_completion(messages, max_tokens).text
+
+    def create_completion(self, messages, max_tokens=None):
+        """Send chat messages through the scheduler and return the Completion."""
+        max_tokens = max_tokens or self.max_tokens
+        try:
+            response = self.scheduler.run(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens
+                ),
+                self.estimate_tokens(messages, max_tokens)
+            )
+            return self.read_completion(response)
+        except OpenAIError as e:
+            raise self.report_error(e) from e
+
+    def read_completion(self, response):
+        choice = response.choices[0]
+        text = choice.message.content.strip()
+        usage = getattr(response, 'usage', None)
+        if usage is not None and usage.completion_tokens is not None:
+            completion_tokens = usage.completion_tokens
+        else:
+            completion_tokens = SUSTAIN.count_tokens(text, self.model)
+        return Completion(text, completion_tokens, choice.finish_reason)
+
+    def stream_openai_response(self, user_input):
+        """Yield the response text in chunks as the API produces them.
+
+        Chunks are passed on as they arrive, so the class's post-processor is not applied.
+        """
+        plan = self.response_budget.plan(user_input)
+        try:
+            stream = self.scheduler.run(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=plan.messages,
+                    max_tokens=plan.max_tokens,
+                    stream=True
+                ),
+                self.estimate_tokens(plan.messages, plan.max_tokens)
+            )
+        except OpenAIError as e:
+            raise self.report_error(e) from e
+
+        parts = []
+        finish_reason = None
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                if chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        except OpenAIError as e:
+            raise self.report_error(e) from e
+        finally:
+            # Release the connection if the caller stops reading early
+            if hasattr(stream, 'close'):
+                stream.close()
+        self.response_budget.record(plan, SUSTAIN.count_tokens(''.join(parts), self.model), finish_reason)
+
+    def get_async_client(self):
+        """Return the pooled async client for the running event loop.
+
+        Use it inside async_session(), or call aclose() before the loop ends.
+        """
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_loop is not loop:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+            self.async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=limits)
+            )
+            self.async_loop = loop
+        return self.async_client
+
+    async def get_openai_response_async(self, user_input):
+        plan = self.response_budget.plan(user_input)
+        client = self.get_async_client()
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "user", "content": f"{user_input} in <20 words."}
-                ],
-                max_tokens=50
+            response = await self.scheduler.run_async(
+                lambda: client.chat.completions.create(
+                    model=self.model,
+                    messages=plan.messages,
+                    max_tokens=plan.max_tokens
+                ),
+                self.estimate_tokens(plan.messages, plan.max_tokens)
             )
-            return response.choices[0].message.content.strip()
-        except OpenAI.error.OpenAIError as e:
-            logging.error(f"OpenAIError: {str(e)}")
-            return self.handle_api_error(e)
+            completion = self.read_completion(response)
+        except OpenAIError as e:
+            raise self.report_error(e) from e
+        self.response_budget.record(plan, completion.completion_tokens, completion.finish_reason)
+        return completion.text
+
+    @contextlib.asynccontextmanager
+    async def async_session(self):
+        """Keep the pooled async client open for the block.
+
+        Blocks on the same event loop share the client; the last one to exit closes it.
+        """
+        loop = asyncio.get_running_loop()
+        self.async_sessions[loop] = self.async_sessions.get(loop, 0) + 1
+        try:
+            yield self
+        finally:
+            self.async_sessions[loop] -= 1
+            if not self.async_sessions[loop]:
+                del self.async_sessions[loop]
+                if self.async_loop is loop:
+                    await self.aclose()
+
+    async def aclose(self):
+        """Close the pooled async client."""
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+            self.async_loop = None
+
+    def report_error(self, error):
+        """Log an API error and return the APIRequestError to raise in its place.
+
+        Errors are raised rather than returned as text so they are never cached.
+        """
+        logging.error(f"OpenAIError: {str(error)}")
+        return APIRequestError(self.handle_api_error(error))
 
     @staticmethod
     def handle_api_error(error):
-        if error.code == 'insufficient_quota':
-            return "Error: The API quota has been exceeded. Please contact SUSTAIN."
-        elif error.code == 'model_not_found':
+        code = getattr(error, 'code', None)
+        if code == 'insufficient_quota':
+            return "The API quota has been exceeded. Please contact SUSTAIN."
+        elif code == 'model_not_found':
             return (
-                "Error: The specified model does not exist or you do not have access to it."
+                "The specified model does not exist or you do not have access to it."
             )
-        return f"Error: {str(error)}"
+        return str(error)
+
+
+# Number words understood by the math optimizer
+NUMBER_WORDS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+    'thirteen': 13, 'fourteen': 14, 'fifteen': 15, 'sixteen': 16, 'seventeen': 17,
+    'eighteen': 18, 'nineteen': 19, 'twenty': 20, 'thirty': 30, 'forty': 40,
+    'fifty': 50, 'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90
+}
+SCALE_WORDS = {'thousand': 1000, 'million': 1000000, 'billion': 1000000000}
+
+# Operator words, longest first so "divided by" is preferred over a lone word
+OPERATOR_WORDS = [
+    (('to', 'the', 'power', 'of'), '**'),
+    (('multiplied', 'by'), '*'),
+    (('divided', 'by'), '/'),
+    (('plus',), '+'),
+    (('minus',), '-'),
+    (('times',), '*'),
+    (('over',), '/'),
+    (('x',), '*'),
+]
+
+MATH_QUESTION_PREFIX = re.compile(
+    r'^(please tell me|what is|what\'s|whats|please|can you)\s*', re.IGNORECASE
+)
+MATH_INVALID_CHARACTERS = re.compile(r'[^\w\s\+\-\*/\^\(\)\.]')
+MATH_TOKEN = re.compile(r'(\d+(?:\.\d+)?)|([a-z]+)|(\*\*|[-+*/^()])|(\S)')
+OPERATOR_PATTERN = re.compile(
+    r'\b(?:to the power of|multiplied by|divided by|plus|minus|times|over|x)\b|\^',
+    re.IGNORECASE
+)
+
+# Cheap check run before the full parse: any operator symbol or operator word
+MATH_HINT = re.compile(
+    r'[-+*/^]|\b(?:plus|minus|times|multiplied|divided|over|x|power)\b', re.IGNORECASE
+)
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+MAX_EXPONENT = 1000  # Larger powers could take unbounded time and memory
+# Integer results are kept well within the size str() will convert (4300 digits)
+MAX_RESULT_BITS = 4096
+
+
+def words_to_number(words):
+    """Convert a sequence of number words (e.g. "one hundred and five") to a number."""
+    total, current, previous = 0, 0, None
+    decimals = None
+    for word in words:
+        if decimals is not None:
+            # Only single digits may follow "point"
+            if NUMBER_WORDS.get(word, 10) >= 10:
+                return None
+            decimals.append(str(NUMBER_WORDS[word]))
+        elif word == 'point':
+            decimals = []
+        elif word == 'and':
+            continue
+        elif word in NUMBER_WORDS:
+            value = NUMBER_WORDS[word]
+            # "twenty five" is a number, "five twenty" and "two three" are not
+            if previous == 'units' or (previous == 'tens' and value >= 10):
+                return None
+            current += value
+            previous = 'tens' if value >= 20 else 'units'
+        elif word == 'hundred':
+            current = (current or 1) * 100
+            previous = 'hundred'
+        elif word in SCALE_WORDS:
+            total += (current or 1) * SCALE_WORDS[word]
+            current = 0
+            previous = 'scale'
+        else:
+            return None
+
+    if previous is None or decimals == []:
+        return None
+    number = total + current
+    if decimals:
+        return float(f"{number}.{''.join(decimals)}")
+    return number
+
+
+def is_number_word(word):
+    return word in NUMBER_WORDS or word in SCALE_WORDS or word in ('hundred', 'point')
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_math(text):
+    """Tokenize cleaned text into a normalized arithmetic expression, or None if it is not math."""
+    words, tokens = [], []
+    for number, word, symbol, other in MATH_TOKEN.findall(text.lower().rstrip('.')):
+        if other:
+            return None
+        words.append(number or word or symbol)
+
+    binary_operators = 0
+    i = 0
+    while i < len(words):
+        word = words[i]
+        if word[0].isdigit():
+            tokens.append(word)
+            i += 1
+            continue
+        if word in '()':
+            tokens.append(word)
+            i += 1
+            continue
+
+        symbol = '**' if word == '^' else word if word in ('+', '-', '*', '/', '**') else None
+        length = 1
+        if symbol is None:
+            for phrase, phrase_symbol in OPERATOR_WORDS:
+                if tuple(words[i:i + len(phrase)]) == phrase:
+                    symbol, length = phrase_symbol, len(phrase)
+                    break
+        if symbol is not None:
+            # An operator after a number or closing bracket is binary, otherwise unary
+            if tokens and (tokens[-1][0].isdigit() or tokens[-1] == ')'):
+                binary_operators += 1
+            elif symbol not in ('+', '-'):
+                return None
+            tokens.append(symbol)
+            i += length
+            continue
+
+        # Gather a run of number words, allowing "and" inside it
+        end = i
+        while end < len(words) and (
+            is_number_word(words[end])
+            or (words[end] == 'and' and end + 1 < len(words) and is_number_word(words[end + 1]))
+        ):
+            end += 1
+        value = words_to_number(words[i:end]) if end > i else None
+        if value is None:
+            return None
+        tokens.append(str(value))
+        i = end
+
+    if not binary_operators:
+        return None
+    expression = ' '.join(tokens)
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        return None
+    # Reject anything that is not plain arithmetic, e.g. "2 (3)" parsing as a call
+    for node in ast.walk(tree.body):
+        if not isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Constant, ast.operator, ast.unaryop)):
+            return None
+    return expression
+
+
+@functools.lru_cache(maxsize=1024)
+def evaluate_math(expression):
+    """Evaluate a normalized arithmetic expression without eval."""
+    return _evaluate_node(ast.parse(expression, mode='eval').body)
+
+
+def _evaluate_node(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        return UNARY_OPERATORS[type(node.op)](_evaluate_node(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        left, right = _evaluate_node(node.left), _evaluate_node(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > MAX_EXPONENT:
+            raise ValueError("exponent too large")
+        # Estimate the size of integer products and powers before computing them
+        if isinstance(left, int) and isinstance(right, int):
+            if isinstance(node.op, ast.Pow) and right > 0:
+                estimated_bits = abs(left).bit_length() * right
+            elif isinstance(node.op, ast.Mult):
+                estimated_bits = abs(left).bit_length() + abs(right).bit_length()
+            else:
+                estimated_bits = 0
+            if estimated_bits > MAX_RESULT_BITS:
+                raise ValueError("result too large")
+        result = BINARY_OPERATORS[type(node.op)](left, right)
+        if isinstance(result, int) and result.bit_length() > MAX_RESULT_BITS:
+            raise ValueError("result too large")
+        return result
+    raise ValueError("unsupported expression")
 
 
 class MathOptimizer:
@@ -69,65 +510,161 @@ class MathOptimizer:
 
     def convert_number(self, user_input):
         """Convert word-based numbers to numeric values."""
-        try:
-            return w2n.word_to_num(user_input)
-        except ValueError:
-            return user_input  # Return as-is if it's not a valid word-to-number
+        number = words_to_number(user_input.lower().split())
+        return user_input if number is None else number  # Return as-is if it's not a valid word-to-number
 
     def clean_input(self, user_input):
         """Clean up the input to remove unnecessary parts like question words and punctuation."""
-        user_input = re.sub(
-            r'^(what is|what\'s|whats|please|can you|please tell me)\s*',
-            '',
-            user_input,
-            flags=re.IGNORECASE
-        )
-        user_input = re.sub(r'[^\w\s\+\-\*/\^\(\)]', '', user_input)  # Remove invalid characters
+        user_input = MATH_QUESTION_PREFIX.sub('', user_input.strip())
+        user_input = MATH_INVALID_CHARACTERS.sub('', user_input)  # Remove invalid characters
         return ' '.join(user_input.split())  # Remove excessive spaces
 
+    def parse_expression(self, user_input):
+        """Convert a math prompt into a normalized expression such as "4 * 3", or None."""
+        return parse_math(self.clean_input(user_input))
+
+    def might_be_math(self, user_input):
+        """Cheaply check whether the input mentions any operator at all."""
+        return MATH_HINT.search(user_input) is not None
+
     def recognize_math(self, user_input):
-        """Recognize a math expression by looking for numbers and operators."""
-        math_pattern = (
-            r'(\d+|\w+)\s*(\+|\-|\*|\/|\bplus\b|\bminus\b|\btimes\b|\bdivided\b|\bto\s+the\s+power\s+of\b|\^)'
-            r'\s*(\d+|\w+)'
-        )
-        return bool(re.search(math_pattern, user_input, re.IGNORECASE))
+        """Recognize a math expression: an operator hint, then a full parse of the prompt."""
+        if not self.might_be_math(user_input):
+            return False
+        return self.parse_expression(user_input) is not None
 
     def convert_ops(self, user_input):
         """Convert word-based operators (e.g., 'plus') to mathematical symbols (e.g., '+')."""
-        for word, operator in self.word_to_operator.items():
-            user_input = user_input.replace(word, operator)
-        return user_input
+        return OPERATOR_PATTERN.sub(
+            lambda match: self.word_to_operator[match.group(0).lower()], user_input
+        )
 
     def solve_math(self, user_input):
         """Solve the mathematical expression."""
-        user_input = self.clean_input(user_input)  # Step 1: Clean the input
-        input_parts = user_input.split()
-
-        # Step 2: Handle word-based numbers and operators
-        for i in range(len(input_parts)):
-            number = self.convert_number(input_parts[i])
-            if number is not None:
-                input_parts[i] = str(number)
-
-        user_input = " ".join(input_parts)  # Step 3: Reconstruct the input
-        user_input = self.convert_ops(user_input)  # Step 4: Convert operators
+        expression = self.parse_expression(user_input)
+        if expression is None:
+            return "Error: Invalid math expression"
 
-        # Step 5: Safely evaluate the mathematical expression
+        # Safely evaluate the mathematical expression
         try:
-            if re.match(r'^[\d+\-*/(). ]+$', user_input):
-                return eval(user_input)
-            return "Error: Invalid math expression"
+            return evaluate_math(expression)
         except Exception as e:
             return f"Error: {str(e)}"
 
 
+def rule_token_delta(encoding, phrase, replacement):
+    """Tokens saved each time phrase is rewritten to replacement.
+
+    Rules are measured in context, after a space as they appear mid-sentence. A
+    removal also takes the space before the phrase with it.
+    """
+    before = len(encoding.encode(' ' + phrase))
+    after = len(encoding.encode(' ' + replacement)) if replacement else 0
+    return before - after
+
+
+class RewriteRules:
+    """Phrase rewrites compiled into a single alternation and applied in one pass."""
+
+    def __init__(self, rules, encoding=None):
+        # Rules are ordered (phrase, replacement) pairs. A phrase that contains an
+        # earlier phrase can never match once the earlier one has been applied, so
+        # it is dropped to keep the single pass equivalent to applying rules in turn.
+        # Given an encoding, rules that do not save tokens in it are dropped first.
+        self.replacements = {}
+        self.token_deltas = {}  # phrase -> tokens saved per application
+        self.dropped = {}  # phrase -> token delta of rules that saved nothing
+        earlier = []
+        for phrase, replacement in rules:
+            key = phrase.lower()
+            if not key or key in self.replacements:
+                continue
+            if encoding is not None:
+                delta = rule_token_delta(encoding, phrase, replacement)
+                if delta <= 0:
+                    self.dropped.setdefault(key, delta)
+                    continue
+            if any(pattern.search(key) for pattern in earlier):
+                continue
+            self.replacements[key] = replacement
+            if encoding is not None:
+                self.token_deltas[key] = delta
+            earlier.append(re.compile(r'\b' + re.escape(key) + r'\b'))
+
+        # Longest phrases first so rules starting at the same word resolve to the
+        # longest match
+        alternatives = sorted(self.replacements, key=len, reverse=True)
+        self.pattern = None
+        if alternatives:
+            self.pattern = re.compile(
+                r'\b(?:' + '|'.join(self._alternative(phrase) for phrase in alternatives) + r')',
+                re.IGNORECASE
+            )
+
+    def _alternative(self, phrase):
+        """Build the pattern for one phrase, deferring to earlier overlapping rules."""
+        alternative = re.escape(phrase) + r'\b'
+        words = phrase.split(' ')
+        for earlier in self.replacements:
+            if earlier == phrase:
+                break
+            # An earlier rule that begins inside this phrase and runs past its end
+            # would have been applied first, so this phrase must not match there
+            earlier_words = earlier.split(' ')
+            for overlap in range(1, min(len(words), len(earlier_words))):
+                if words[-overlap:] == earlier_words[:overlap]:
+                    remainder = ' '.join(earlier_words[overlap:])
+                    alternative += r'(?! ' + re.escape(remainder) + r'\b)'
+        return alternative
+
+    def apply(self, text, savings=None):
+        """Apply every rule to the text in a single scan.
+
+        Given a savings dict, the tokens saved by each rule are added to it by phrase.
+        """
+        if self.pattern is None:
+            return text
+        if savings is None:
+            return self.pattern.sub(self._replace, text)
+
+        def replace(match):
+            key = match.group(0).lower()
+            if key in self.token_deltas:
+                savings[key] = savings.get(key, 0) + self.token_deltas[key]
+            return self.replacements.get(key, match.group(0))
+        return self.pattern.sub(replace, text)
+
+    def _replace(self, match):
+        matched = match.group(0)
+        return self.replacements.get(matched.lower(), matched)
+
+
+# Sentence punctuation and quotes at the edges of words, which do not change a
+# prompt's meaning. Symbols inside words (C++, C#, what's) are kept.
+EDGE_PUNCTUATION = re.compile(r"""(?:(?<=\s)|^)['"(\[]+|[.,!?;:'")\]]+(?=\s|$)""")
+
+
 class TextOptimizer:
-    def __init__(self):
-        self.nlp = spacy.load("en_core_web_sm")
+    def __init__(self, model=DEFAULT_MODEL):
         self.contractions = self.load_contractions()
         self.phrases_to_remove = self.load_phrases_to_remove()
 
+        # Removals are listed before contractions so they take precedence. Rewrites
+        # that do not save tokens in the model's encoding (e.g. "and" -> "&") only
+        # change the wording, so they are left out.
+        encoding = get_encoding(model)
+        self.rewrite_rules = RewriteRules(
+            [(phrase, '') for phrase in self.phrases_to_remove]
+            + list(self.contractions.items()),
+            encoding
+        )
+        self.contraction_rules = RewriteRules(self.contractions.items(), encoding)
+
+    @property
+    def nlp(self):
+        """The shared spaCy model. Optimization itself does not need it."""
+        return get_nlp()
+
     @staticmethod
     def load_contractions():
         """Load common contractions for text optimization."""
@@ -150,18 +687,26 @@ class TextOptimizer:
         except FileNotFoundError:
             return []
 
-    def optimize_text(self, text):
-        """Optimize text by removing unnecessary phrases and converting to contractions."""
-        for phrase in self.phrases_to_remove:
-            text = re.sub(r'\b' + re.escape(phrase) + r'\b', '', text, flags=re.IGNORECASE)
-        text = self.convert_to_contractions(text)
+    def optimize_text(self, text, savings=None):
+        """Optimize text by removing unnecessary phrases and converting to contractions.
+
+        Given a savings dict, the tokens saved by each rule are added to it by phrase.
+        """
+        text = self.rewrite_rules.apply(text, savings)
         return ' '.join(text.split()).strip()
 
+    def canonicalize(self, text):
+        """Reduce text to the canonical form used to match equivalent prompts."""
+        return self.normalize(self.optimize_text(text))
+
+    @staticmethod
+    def normalize(text):
+        """Normalize case, whitespace and edge punctuation of already optimized text."""
+        return ' '.join(EDGE_PUNCTUATION.sub('', text.lower()).split())
+
     def convert_to_contractions(self, text):
         """Convert phrases to contractions."""
-        for phrase, contraction in self.contractions.items():
-            text = re.sub(r'\b' + re.escape(phrase) + r'\b', contraction, text, flags=re.IGNORECASE)
-        return text
+        return self.contraction_rules.apply(text)
 
     @staticmethod
     def trim_response(response_text):
@@ -184,16 +729,111 @@ class TextOptimizer:
     def truncate_list(response_text):
         """Truncate a list in the response to the first three items."""
         items = response_text.split(",")
+        # An introduction such as "Here are three fruits:" is not part of the first item
+        if ":" in items[0] and all(":" not in item for item in items[1:]):
+            items[0] = items[0].split(":", 1)[1]
         cleaned_items = [item.split(":")[0].strip() for item in items]
         return ", ".join(cleaned_items[:3])
 
 
+# An optimized prompt with the token counts it was measured by
+OptimizedPrompt = namedtuple(
+    'OptimizedPrompt', ['text', 'original_tokens', 'optimized_tokens', 'percentage_saved']
+)
+
+# Routes whose answers came from the API, now or earlier, and are post-processed
+RESPONSE_ROUTES = (APIAnswerer.name, CacheAnswerer.name, COALESCED_ROUTE)
+
+
+class ResponseStream:
+    """Chunks of one response, with the full text handed to on_complete when the stream ends.
+
+    If reading the chunks fails, or the stream is closed before the end, on_error
+    is called with the error instead.
+    """
+
+    def __init__(self, chunks, percentage_saved, route, on_complete=None, on_error=None):
+        self.chunks = chunks
+        self.percentage_saved = percentage_saved
+        self.route = route
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.parts = []
+        self.completed = False
+
+    def __iter__(self):
+        try:
+            for chunk in self.chunks:
+                self.parts.append(chunk)
+                yield chunk
+            self.completed = True
+        except Exception as e:
+            self.fail(e)
+            raise
+        finally:
+            # Also reached when the stream is dropped part way through
+            if not self.completed:
+                self.fail(RuntimeError("The response was stopped before it finished"))
+        if self.on_complete is not None:
+            self.on_complete(self.text)
+
+    def fail(self, error):
+        on_error, self.on_error = self.on_error, None  # Report at most once
+        if on_error is not None and not self.completed:
+            on_error(error)
+
+    @property
+    def text(self):
+        """The response text received so far."""
+        return ''.join(self.parts).strip()
+
+    def close(self):
+        """Stop the stream early. An unfinished response is never cached."""
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+        self.fail(RuntimeError("The response was stopped before it finished"))
+
+    def __del__(self):
+        # A stream dropped before it was read must still release its waiters
+        self.fail(RuntimeError("The response was stopped before it finished"))
+
+
 class SUSTAIN:
-    def __init__(self, api_key):
-        self.api_client = OpenAIClient(api_key)
-        self.text_optimizer = TextOptimizer()
-        self.cache = {}
+    def __init__(self, api_key, cache=None, faq_answers=FAQ_ANSWERS, api_client=None, usage_log=None,
+                 batch_window=None):
+        self.metrics_registry = Metrics()
+        self.metrics_registry.add_sink(log_stage_timing)
+        self.ledger = TokenLedger()
+        if usage_log is None:
+            usage_log = UsageLog(os.getenv("SUSTAIN_USAGE_LOG_PATH", DEFAULT_USAGE_LOG_PATH))
+        self.usage_log = usage_log
+        if api_client is None:
+            api_client = OpenAIClient(api_key, metrics=self.metrics_registry)
+        self.api_client = api_client
+        self.text_optimizer = TextOptimizer(self.api_client.model)
+        if cache is None:
+            cache_path = os.getenv("SUSTAIN_CACHE_PATH", DEFAULT_CACHE_PATH)
+            cache = TieredCache(SQLiteCache(cache_path))
+        self.cache = cache
         self.math_optimizer = MathOptimizer()
+        self.flights = SingleFlight(self.metrics_registry)
+
+        # With a batching window (in seconds), prompts that reach the API within it
+        # are answered together in one request
+        if batch_window is None:
+            batch_window = float(os.getenv("SUSTAIN_BATCH_WINDOW_MS", 0)) / 1000
+        self.batcher = None
+        if batch_window > 0:
+            self.batcher = MicroBatcher(self.api_client, batch_window, metrics=self.metrics_registry)
+        self.responder = self.batcher if self.batcher is not None else self.api_client
+
+        # Local answerers run first, cheapest first; the API is the last resort
+        self.router = QueryRouter([
+            MathAnswerer(self.math_optimizer),
+            FAQAnswerer(self.text_optimizer, faq_answers),
+            CacheAnswerer(self.cache),
+            APIAnswerer(self.responder, self.cache, self.flights),
+        ], self.metrics_registry)
 
     def answer_math(self, user_input):
         """Answer math queries directly without calling the API."""
@@ -201,30 +841,212 @@ class SUSTAIN:
             return self.math_optimizer.solve_math(user_input)
         return None
 
+    def answer(self, user_input):
+        """Route a prompt to the first answerer that can handle it and return its Answer."""
+        with request_context():
+            self.metrics_registry.increment("requests")
+            query = Query(self, user_input)
+            answer = self.router.route(query)
+            self.record_tokens(query, answer.text, answer.route)
+            if answer.route in RESPONSE_ROUTES:
+                answer = answer._replace(text=self.post_process(query, answer.text))
+            return answer
+
     def get_response(self, user_input):
         """Get a response from the OpenAI API or handle math queries."""
-        math_answer = self.answer_math(user_input)
-        if math_answer is not None:
-            return math_answer, 100  # Assume 100% token savings for math optimizations
+        answer = self.answer(user_input)
+        return answer.text, answer.percentage_saved
+
+    def get_response_stream(self, user_input):
+        """Get a response as a ResponseStream that yields text as it arrives."""
+        with request_context():
+            self.metrics_registry.increment("requests")
+            query = Query(self, user_input)
+            answer = self.router.route(query, local_only=True)
+            if answer is not None:
+                self.record_tokens(query, answer.text, answer.route)
+                response_text = str(answer.text)
+                if answer.route in RESPONSE_ROUTES:
+                    response_text = self.post_process(query, response_text)
+                return ResponseStream(iter([response_text]), answer.percentage_saved, answer.route)
+
+            cache_key = query.cache_key
+            flight, leader = self.flights.join(cache_key)
+            if not leader:
+                # An identical prompt is already streaming; wait for its full response
+                self.router.record(COALESCED_ROUTE)
+
+                def shared_response():
+                    yield self.post_process(query, flight.wait(self.flights.timeout))
+
+                return ResponseStream(
+                    shared_response(),
+                    query.percentage_saved,
+                    COALESCED_ROUTE,
+                    on_complete=lambda response_text: self.record_tokens(query, response_text, COALESCED_ROUTE)
+                )
+
+            self.router.record(APIAnswerer.name)
+            started = time.perf_counter()
 
-        if user_input in self.cache:
-            return self.cache[user_input]
+            def on_complete(response_text):
+                # Only a stream that runs to the end is timed and cached
+                self.metrics_registry.observe("api", time.perf_counter() - started)
+                self.record_tokens(query, response_text, APIAnswerer.name)
+                self.cache.set(cache_key, response_text)
+                self.flights.finish(cache_key, flight, result=response_text)
 
-        optimized_input = self.text_optimizer.optimize_text(user_input)
-        original_tokens = self.count_tokens(user_input)
-        optimized_tokens = self.count_tokens(optimized_input)
+            return ResponseStream(
+                self.api_client.stream_openai_response(query.optimized_input),
+                query.percentage_saved,
+                APIAnswerer.name,
+                on_complete=on_complete,
+                on_error=lambda error: self.stream_failed(cache_key, flight, error)
+            )
+
+    def stream_failed(self, cache_key, flight, error):
+        """Release the callers waiting on a streamed API call that failed or was stopped."""
+        if isinstance(error, APIRequestError):
+            self.metrics_registry.increment("api_errors")
+        self.flights.finish(cache_key, flight, error=error)
+
+    async def get_responses_async(self, prompts, concurrency=8):
+        """Answer many prompts concurrently, returning results in prompt order."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def answer(user_input):
+            with request_context():
+                self.metrics_registry.increment("requests")
+                query = Query(self, user_input)
+                local_answer = self.router.route(query, local_only=True)
+                if local_answer is not None:
+                    self.record_tokens(query, local_answer.text, local_answer.route)
+                    return local_answer.text, local_answer.percentage_saved
+
+                async def fetch():
+                    # Check the cache again in case an identical call just filled it
+                    cached = self.cache.get(query.cache_key)
+                    if cached is not None:
+                        return cached, CacheAnswerer.name
+                    async with semaphore:
+                        with self.metrics_registry.timer("api"):
+                            try:
+                                response_text = await self.responder.get_openai_response_async(
+                                    query.optimized_input
+                                )
+                            except Exception:
+                                self.metrics_registry.increment("api_errors")
+                                raise
+                    self.cache.set(query.cache_key, response_text)
+                    return response_text, APIAnswerer.name
+
+                # Identical prompts in the batch share one call
+                (response_text, route), shared = await self.flights.do_async(query.cache_key, fetch)
+                route = COALESCED_ROUTE if shared else route
+                self.router.record(route)
+                self.record_tokens(query, response_text, route)
+                return self.post_process(query, response_text), query.percentage_saved
+
+        # The pool is bound to this event loop, which usually ends with the call, so
+        # it is closed once no other batch call on the loop is still using it
+        session = contextlib.nullcontext()
+        if hasattr(self.api_client, 'async_session'):
+            session = self.api_client.async_session()
+        async with session:
+            return await asyncio.gather(*(answer(user_input) for user_input in prompts))
+
+    def post_process(self, query, response_text):
+        """Shape an API response, fresh or cached, for the prompt's query class."""
+        response_budget = getattr(self.api_client, 'response_budget', None)
+        if response_budget is None:
+            return response_text
+        return response_budget.post_process(query.optimized_input, response_text)
+
+    def optimize_prompt(self, user_input):
+        """Optimize a prompt and work out the percentage of tokens it saves."""
+        rule_savings = {}
+        with self.metrics_registry.timer("optimize"):
+            optimized_input = self.text_optimizer.optimize_text(user_input, rule_savings)
+        for rule, tokens in rule_savings.items():
+            self.metrics_registry.increment("rule_tokens_saved", tokens, rule=rule)
+        with self.metrics_registry.timer("count_tokens"):
+            original_tokens, optimized_tokens = self.count_tokens_many(
+                [user_input, optimized_input], self.api_client.model
+            )
         percentage_saved = self.calculate_percentage_saved(original_tokens, optimized_tokens)
+        return OptimizedPrompt(optimized_input, original_tokens, optimized_tokens, percentage_saved)
+
+    def record_tokens(self, query, response_text, route):
+        """Add one answered query to the token ledger, and count API traffic in the metrics."""
+        response_tokens = self.count_tokens(str(response_text), self.api_client.model)
+        sent_tokens = query.optimized.optimized_tokens if route == APIAnswerer.name else 0
+        self.record_usage(route, query.original_tokens, sent_tokens, response_tokens)
+
+    def record_usage(self, route, original_tokens, sent_tokens, response_tokens):
+        """Add token counts to the ledger and usage log; tokens sent to the API also go into the metrics."""
+        if sent_tokens:
+            self.metrics_registry.increment("tokens_in", sent_tokens)
+            self.metrics_registry.increment("tokens_out", response_tokens)
+        tokens_saved = self.ledger.record(route, original_tokens, sent_tokens, response_tokens)
+        self.usage_log.record(route, original_tokens, sent_tokens, response_tokens, tokens_saved)
+
+    def start_conversation(self, budget=DEFAULT_CONTEXT_BUDGET, keep_recent=DEFAULT_KEEP_RECENT):
+        """Start a multi-turn conversation whose context is kept within a token budget."""
+        return Conversation(self, budget, keep_recent)
 
-        response_text = self.api_client.get_openai_response(optimized_input)
+    def metrics(self):
+        """Return a snapshot of stage timings, counters, routing decisions and cache statistics."""
+        snapshot = self.metrics_registry.snapshot()
+        snapshot["routes"] = self.router.stats()
+        snapshot["cache"] = self.cache.stats()
+        snapshot["ledger"] = self.ledger.snapshot()
+        snapshot["lifetime"] = self.usage_log.savings()
+        scheduler = getattr(self.api_client, "scheduler", None)
+        if scheduler is not None:
+            snapshot["scheduler"] = scheduler.stats()
+        if self.batcher is not None:
+            snapshot["batching"] = self.batcher.stats()
+        response_budget = getattr(self.api_client, "response_budget", None)
+        if response_budget is not None:
+            snapshot["response_budget"] = response_budget.stats()
+        return snapshot
 
-        self.cache[user_input] = (response_text, percentage_saved)
-        return response_text, percentage_saved
+    def close(self):
+        """Answer any batched prompts, write out the usage log and release the cache."""
+        if self.batcher is not None:
+            self.batcher.close()
+        self.usage_log.close()
+        self.cache.close()
+
+    def export_metrics(self, format="json"):
+        """Render the metrics as JSON or in the Prometheus text format."""
+        if format == "prometheus":
+            scheduler = getattr(self.api_client, "scheduler", None)
+            if scheduler is not None:
+                self.metrics_registry.set_gauge("queue_depth", scheduler.queue_depth())
+            return self.metrics_registry.to_prometheus()
+        return json.dumps(self.metrics(), indent=2)
+
+    def cache_key(self, optimized_input):
+        """Build the cache key for an optimized prompt."""
+        return f"{self.api_client.model}:{self.text_optimizer.normalize(optimized_input)}"
 
     @staticmethod
-    def count_tokens(text):
+    def count_tokens(text, model=DEFAULT_MODEL):
         """Count the number of tokens in the text."""
-        tokenizer = tiktoken.get_encoding("cl100k_base")
-        return len(tokenizer.encode(text))
+        return len(get_encoding(model).encode(text))
+
+    @staticmethod
+    def count_tokens_many(texts, model=DEFAULT_MODEL, num_threads=8):
+        """Count the number of tokens in each text, encoding large batches on several threads."""
+        encoding = get_encoding(model)
+        texts = list(texts)
+        # encode_batch starts a thread pool on every call, which costs far more than
+        # encoding a handful of short texts directly
+        if len(texts) < MIN_THREADED_BATCH:
+            return [len(encoding.encode(text)) for text in texts]
+        encoded = encoding.encode_batch(texts, num_threads=num_threads)
+        return [len(tokens) for tokens in encoded]
 
     @staticmethod
     def calculate_percentage_saved(original_tokens, optimized_tokens):
@@ -0,0 +1,249 @@
+"""
+Description: This module contains the chat transcript widget used by the SUSTAIN
+chat application. Messages are kept as lightweight data and only the bubbles in
+the visible part of the transcript are drawn, using a small pool of canvas items
+that is reused as the user scrolls. Redraws are batched into one per idle cycle.
+"""
+
+# Import required libraries
+import tkinter as tk
+from bisect import bisect_left, bisect_right
+
+USER_BUBBLE_COLOR = "#eaeaea"  # Light grey for user
+SUSTAIN_BUBBLE_COLOR = "#99d3ab"  # Light green for AI
+NOTE_COLOR = "grey"
+BUBBLE_FONT = ("Mangal_Pro", 14)
+MESSAGE_GAP = 16  # Vertical space between messages
+BUBBLE_PADDING = 10  # Space between a bubble and the side of the transcript
+BUBBLE_RADIUS = 15
+
+
+class Message:
+    """One transcript entry: a "user" or "sustain" bubble, or a plain "text" or "note" line."""
+
+    __slots__ = ("kind", "text", "index", "height", "version")
+
+    def __init__(self, kind, text, index):
+        self.kind = kind
+        self.text = text
+        self.index = index
+        self.height = None  # Computed lazily for the current transcript width
+        self.version = 0
+
+
+def rounded_rectangle_points(x1, y1, x2, y2, radius):
+    """Return polygon points that draw a rounded rectangle when smoothed."""
+    return [
+        x1 + radius, y1, x2 - radius, y1,
+        x2, y1, x2, y1 + radius,
+        x2, y2 - radius, x2, y2,
+        x2 - radius, y2, x1 + radius, y2,
+        x1, y2, x1, y2 - radius,
+        x1, y1 + radius, x1, y1
+    ]
+
+
+class TranscriptView(tk.Frame):
+    """Scrollable chat transcript that only keeps the visible messages drawn."""
+
+    def __init__(self, master, font=("Mangal_Pro", 16), **kwargs):
+        super().__init__(master, **kwargs)
+        self.font = font
+        self.fg_color = "black"
+        self.messages = []
+        self.tops = []  # Top y coordinate of each message
+        self.total_height = 0
+        self.dirty_from = 0  # First message whose position needs recomputing
+        self.layout_width = None
+
+        # Drawn slots keyed by message index, plus spare slots ready for reuse
+        self.slots = {}
+        self.free_slots = []
+        self.render_pending = False
+        self.follow = True  # Keep the newest message in view
+
+        self.canvas = tk.Canvas(self, highlightthickness=0, yscrollincrement=20)
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", lambda event: self.schedule_render())
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(3))
+
+    def add(self, kind, text):
+        """Append a message and return it, so it can later be passed to update_message()."""
+        message = Message(kind, text, len(self.messages))
+        self.messages.append(message)
+        self.schedule_render()
+        return message
+
+    def update_message(self, message, text):
+        """Replace the text of a message, e.g. while its response is streaming in."""
+        message.text = text
+        message.height = None
+        message.version += 1
+        # Messages removed by clear() are no longer shown
+        if message.index < len(self.messages) and self.messages[message.index] is message:
+            self.dirty_from = min(self.dirty_from, message.index)
+            self.schedule_render()
+
+    def clear(self):
+        """Remove every message."""
+        self.messages.clear()
+        self.tops.clear()
+        self.total_height = 0
+        self.dirty_from = 0
+        for slot in self.slots.values():
+            self.hide_slot(slot)
+            self.free_slots.append(slot)
+        self.slots.clear()
+        self.schedule_render()
+
+    def get_text(self):
+        """Return the transcript as plain text."""
+        prefixes = {"user": "You: ", "sustain": "SUSTAIN: "}
+        return "\n".join(prefixes.get(message.kind, "") + message.text for message in self.messages)
+
+    def set_colors(self, bg_color, fg_color):
+        """Apply the theme's background and text colors."""
+        self.fg_color = fg_color
+        self.configure(bg=bg_color)
+        self.canvas.configure(bg=bg_color)
+        for slot in self.slots.values():
+            slot["drawn"] = None  # Force the text colors to be refreshed
+        self.schedule_render()
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.follow = self.at_bottom()
+        self.schedule_render()
+
+    def scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        self.follow = self.at_bottom()
+        self.schedule_render()
+
+    def on_mouse_wheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS small deltas
+        step = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self.scroll(-step or (-1 if event.delta > 0 else 1))
+
+    def at_bottom(self):
+        return self.canvas.yview()[1] >= 0.999
+
+    def schedule_render(self):
+        """Redraw once the current burst of changes has been processed."""
+        if not self.render_pending:
+            self.render_pending = True
+            self.after_idle(self.render)
+
+    def width(self):
+        return self.canvas.winfo_width() if self.canvas.winfo_width() > 1 else 600
+
+    def measure(self, message, width):
+        """Return the bubble width and height of a message without drawing it."""
+        text = message.text
+        if message.kind in ("user", "sustain"):
+            # Calculate width based on content (min 100px, max 70% of chat area width)
+            content_width = min(max(100, len(text) * 8), int(width * 0.7))
+            line_length = content_width // 10  # Approximate chars per line
+            num_lines = max(1, len(text) // line_length + text.count('\n') + 1)
+            return content_width, num_lines * 24 + 20
+        line_length = max(1, (width - 2 * BUBBLE_PADDING) // 9)
+        num_lines = sum(max(1, -(-len(line) // line_length)) for line in text.split('\n'))
+        return width - 2 * BUBBLE_PADDING, num_lines * 22
+
+    def layout(self, width):
+        """Recompute message positions from the first one that changed."""
+        if width != self.layout_width:
+            self.layout_width = width
+            self.dirty_from = 0
+            for message in self.messages:
+                message.height = None
+
+        start = min(self.dirty_from, len(self.tops))
+        del self.tops[start:]
+        y = self.tops[-1] + self.messages[start - 1].height + MESSAGE_GAP if start else MESSAGE_GAP / 2
+        for message in self.messages[start:]:
+            if message.height is None:
+                message.height = self.measure(message, width)[1]
+            self.tops.append(y)
+            y += message.height + MESSAGE_GAP
+        self.total_height = y
+        self.dirty_from = len(self.messages)
+
+    def render(self):
+        """Draw the visible messages, reusing canvas items from messages scrolled out of view."""
+        self.render_pending = False
+        width = self.width()
+        self.layout(width)
+        self.canvas.configure(scrollregion=(0, 0, width, max(self.total_height, 1)))
+        if self.follow:
+            self.canvas.yview_moveto(1.0)
+
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(bisect_right(self.tops, top) - 1, 0)
+        last = min(bisect_left(self.tops, bottom), len(self.messages))
+        visible = range(first, last)
+
+        for index in [index for index in self.slots if index not in visible]:
+            slot = self.slots.pop(index)
+            self.hide_slot(slot)
+            self.free_slots.append(slot)
+
+        for index in visible:
+            slot = self.slots.get(index)
+            if slot is None:
+                slot = self.free_slots.pop() if self.free_slots else self.create_slot()
+                slot["drawn"] = None
+                self.slots[index] = slot
+            self.draw(slot, index, width)
+
+    def create_slot(self):
+        bubble = self.canvas.create_polygon(0, 0, 0, 0, smooth=True, outline="", state="hidden")
+        text = self.canvas.create_text(0, 0, state="hidden")
+        return {"bubble": bubble, "text": text, "drawn": None}
+
+    def hide_slot(self, slot):
+        self.canvas.itemconfigure(slot["bubble"], state="hidden")
+        self.canvas.itemconfigure(slot["text"], state="hidden")
+
+    def draw(self, slot, index, width):
+        """Point a slot's canvas items at a message, skipping the work if nothing changed."""
+        message = self.messages[index]
+        y = self.tops[index]
+        drawn = (id(message), message.version, width, y)
+        if slot["drawn"] == drawn:
+            return
+        slot["drawn"] = drawn
+
+        content_width, height = self.measure(message, width)
+        if message.kind in ("user", "sustain"):
+            if message.kind == "user":
+                x1 = width - BUBBLE_PADDING - content_width
+                color = USER_BUBBLE_COLOR
+            else:
+                x1 = BUBBLE_PADDING
+                color = SUSTAIN_BUBBLE_COLOR
+            self.canvas.coords(
+                slot["bubble"],
+                *rounded_rectangle_points(x1, y, x1 + content_width, y + height, BUBBLE_RADIUS)
+            )
+            self.canvas.itemconfigure(slot["bubble"], fill=color, state="normal")
+            self.canvas.coords(slot["text"], x1 + content_width / 2, y + height / 2)
+            self.canvas.itemconfigure(
+                slot["text"], text=message.text, width=content_width - 20, font=BUBBLE_FONT,
+                fill="black", justify=tk.LEFT, anchor=tk.CENTER, state="normal"
+            )
+        else:
+            self.canvas.itemconfigure(slot["bubble"], state="hidden")
+            self.canvas.coords(slot["text"], BUBBLE_PADDING, y)
+            self.canvas.itemconfigure(
+                slot["text"], text=message.text, width=content_width, font=self.font,
+                fill=NOTE_COLOR if message.kind == "note" else self.fg_color,
+                justify=tk.LEFT, anchor=tk.NW, state="normal"
+            )
@@ -0,0 +1,250 @@
+"""
+Description: This module contains the persistent usage log used by SUSTAIN. Every
+answered request is appended to a compact binary file as one fixed-size record,
+through an in-memory buffer. Daily and per-route rollups are kept next to the
+log, so lifetime savings, energy and CO2 figures are read without scanning it.
+
+A log file is written by one process at a time. The writer holds an exclusive
+lock on it, and a second process opening the same log gets UsageLogLockedError.
+
+Usage:
+    python usage_log.py --daily --start 2026-01-01
+"""
+
+# Import required libraries
+import os
+import json
+import argparse
+import time
+import atexit
+import struct
+import logging
+import threading
+from datetime import date
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_USAGE_LOG_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../sustain_usage.bin')
+)
+MAGIC = b"SUSTAIN-USAGE-1\n"
+
+# timestamp, route, original tokens, sent tokens, response tokens, tokens saved
+RECORD = struct.Struct("<dBIIII")
+ROUTES = ("math", "faq", "cache", "api", "coalesced", "conversation")  # Only ever append, codes are stored
+UNKNOWN_ROUTE = 255
+
+# The same estimates the chat application uses for its CO2 figures
+KWH_PER_TOKEN_SAVED = 0.0001
+CO2_PER_KWH_SAVED = 0.7  # Kilograms of CO2 per kWh
+FIELDS = ("requests", "original_tokens", "sent_tokens", "response_tokens", "tokens_saved")
+
+
+class UsageLogLockedError(RuntimeError):
+    """Raised when another process is already writing to the usage log."""
+
+
+def lock_exclusively(file):
+    """Take an exclusive advisory lock on an open file without waiting. Raises OSError if it is held."""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+class UsageLog:
+    """Append-only per-request token log with precomputed daily and per-route totals."""
+
+    def __init__(self, path=DEFAULT_USAGE_LOG_PATH, buffer_size=256):
+        self.path = path
+        self.rollup_path = path + ".rollup.json"
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Two writers would each save rollups covering only their own records, so
+        # the log is locked for as long as it is open. The lock is held on a side
+        # file, so reading the log itself is never blocked.
+        self.lock_file = open(path + ".lock", "a+b")
+        try:
+            lock_exclusively(self.lock_file)
+        except OSError:
+            self.lock_file.close()
+            raise UsageLogLockedError(
+                f"{path} is in use by another SUSTAIN process. Set SUSTAIN_USAGE_LOG_PATH "
+                "to give this process its own usage log."
+            )
+        self.file = open(path, "a+b")
+        self.size = self.prepare_file()
+        self.load_rollups()
+        atexit.register(self.close)
+
+    def record(self, route, original_tokens, sent_tokens, response_tokens, tokens_saved, timestamp=None):
+        """Log one answered request. It reaches the disk on the next flush."""
+        timestamp = time.time() if timestamp is None else timestamp
+        code = ROUTES.index(route) if route in ROUTES else UNKNOWN_ROUTE
+        packed = RECORD.pack(timestamp, code, original_tokens, sent_tokens, response_tokens, tokens_saved)
+        with self.lock:
+            if self.closed:
+                return
+            self.buffer.append(packed)
+            self.add_to_rollups(timestamp, code, original_tokens, sent_tokens, response_tokens, tokens_saved)
+            if len(self.buffer) >= self.buffer_size:
+                self.flush_locked()
+
+    def flush(self):
+        """Write buffered records and the updated rollups to disk."""
+        with self.lock:
+            if not self.closed:
+                self.flush_locked()
+
+    def flush_locked(self):
+        if not self.buffer:
+            return
+        data = b"".join(self.buffer)
+        self.buffer.clear()
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        self.save_rollups()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.flush_locked()
+            except OSError as e:
+                logging.error(f"Failed to flush the usage log: {str(e)}")
+            self.closed = True
+            self.file.close()
+            self.lock_file.close()  # Releases the lock
+        atexit.unregister(self.close)
+
+    def totals(self):
+        """Lifetime totals, including records still in the buffer."""
+        with self.lock:
+            return dict(zip(FIELDS, self.total))
+
+    def by_route(self):
+        with self.lock:
+            return {route: dict(zip(FIELDS, totals)) for route, totals in self.routes.items()}
+
+    def daily(self, start=None, end=None):
+        """Totals per day (YYYY-MM-DD), optionally limited to an inclusive range of days."""
+        with self.lock:
+            return {
+                day: dict(zip(FIELDS, totals))
+                for day, totals in sorted(self.days.items())
+                if (start is None or day >= start) and (end is None or day <= end)
+            }
+
+    def savings(self):
+        """Lifetime tokens saved and the energy and CO2 that corresponds to."""
+        tokens_saved = self.totals()["tokens_saved"]
+        kwh_saved = tokens_saved * KWH_PER_TOKEN_SAVED
+        return {
+            "tokens_saved": tokens_saved,
+            "kwh_saved": kwh_saved,
+            "co2_saved_kg": kwh_saved * CO2_PER_KWH_SAVED,
+        }
+
+    def records(self):
+        """Yield every record on disk as a tuple, oldest first. Flush first to include buffered ones."""
+        with open(self.path, "rb") as file:
+            file.seek(len(MAGIC))
+            while True:
+                chunk = file.read(RECORD.size * 4096)
+                whole = len(chunk) - len(chunk) % RECORD.size
+                if not whole:
+                    break
+                for timestamp, code, *counts in RECORD.iter_unpack(chunk[:whole]):
+                    yield (timestamp, ROUTES[code] if code < len(ROUTES) else "unknown", *counts)
+
+    def prepare_file(self):
+        """Write the header of a new log, and drop a partial record left by a crash."""
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        if size == 0:
+            self.file.write(MAGIC)
+            self.file.flush()
+            return len(MAGIC)
+
+        self.file.seek(0)
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a SUSTAIN usage log")
+        whole = size - (size - len(MAGIC)) % RECORD.size
+        if whole != size:
+            logging.error(f"Dropping a partial record at the end of {self.path}")
+            self.file.truncate(whole)
+        return whole
+
+    def load_rollups(self):
+        """Load the saved rollups, then catch up on any records written after they were saved."""
+        self.total = [0] * len(FIELDS)
+        self.days = {}
+        self.routes = {}
+        offset = len(MAGIC)
+        try:
+            with open(self.rollup_path, encoding="utf-8") as file:
+                saved = json.load(file)
+            if len(MAGIC) <= saved["offset"] <= self.size:
+                self.total, self.days, self.routes = saved["total"], saved["days"], saved["routes"]
+                offset = saved["offset"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # Missing or unreadable rollups are rebuilt from the log
+
+        if offset < self.size:
+            with open(self.path, "rb") as file:
+                file.seek(offset)
+                for record in RECORD.iter_unpack(file.read(self.size - offset)):
+                    self.add_to_rollups(*record)
+            self.save_rollups()
+
+    def add_to_rollups(self, timestamp, code, *counts):
+        values = (1, *counts)
+        day = date.fromtimestamp(timestamp).isoformat()
+        route = ROUTES[code] if code < len(ROUTES) else "unknown"
+        for totals in (self.total, self.days.setdefault(day, [0] * len(FIELDS)),
+                       self.routes.setdefault(route, [0] * len(FIELDS))):
+            for index, value in enumerate(values):
+                totals[index] += value
+
+    def save_rollups(self):
+        """Atomically replace the rollup file with totals covering the first self.size bytes of the log."""
+        payload = {"offset": self.size, "total": self.total, "days": self.days, "routes": self.routes}
+        temporary_path = self.rollup_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(payload, file)
+        os.replace(temporary_path, self.rollup_path)
+
+
+# Main function to print a savings report from a usage log
+def main():
+    parser = argparse.ArgumentParser(description="Report SUSTAIN's lifetime token savings.")
+    parser.add_argument("--path", default=os.getenv("SUSTAIN_USAGE_LOG_PATH", DEFAULT_USAGE_LOG_PATH),
+                        help="Usage log to read")
+    parser.add_argument("--daily", action="store_true", help="Include totals for each day")
+    parser.add_argument("--start", help="First day to include in the daily totals (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last day to include in the daily totals (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    usage_log = UsageLog(args.path)
+    report = {"totals": usage_log.totals(), "savings": usage_log.savings(), "routes": usage_log.by_route()}
+    if args.daily:
+        report["days"] = usage_log.daily(args.start, args.end)
+    usage_log.close()
+    print(json.dumps(report, indent=2))
+
+
+# Run the main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+'''
+Description: This file benchmarks SUSTAIN's local hot paths (text optimization,
+math solving, token counting and get_response with a stubbed OpenAI client) over
+the checked-in prompt corpus. Results are written as JSON so that runs can be
+compared, and a comparison against a baseline flags any regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output benchmarks/results.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json --threshold 0.1
+'''
+
+# Import required libraries
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'application'))
+
+from cache import TieredCache  # noqa: E402
+from usage_log import UsageLog  # noqa: E402
+from sustain import SUSTAIN, MathOptimizer, TextOptimizer, DEFAULT_MODEL  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.jsonl')
+
+
+class StubOpenAIClient:
+    """Stands in for OpenAIClient so get_response can be timed without the network."""
+
+    model = DEFAULT_MODEL
+
+    def get_openai_response(self, user_input):
+        return "A short stubbed answer of roughly the length SUSTAIN usually gets back."
+
+
+def load_corpus(path=CORPUS_PATH):
+    """Group the corpus prompts by category."""
+    corpus = defaultdict(list)
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                corpus[record['category']].append(record['prompt'])
+    return dict(corpus)
+
+
+def time_calls(function, prompts, repeat):
+    """Time each call over the prompts, repeat times, and summarize in microseconds."""
+    timings = []
+    for _ in range(repeat):
+        for prompt in prompts:
+            start = time.perf_counter()
+            function(prompt)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    return {
+        "calls": len(timings),
+        "mean_us": statistics.fmean(timings),
+        "median_us": statistics.median(timings),
+        "min_us": min(timings),
+    }
+
+
+def build_benchmarks():
+    """Return the named functions to benchmark, each taking a single prompt."""
+    text_optimizer = TextOptimizer()
+    math_optimizer = MathOptimizer()
+
+    # One pipeline whose cache never keeps anything, and one that answers from cache.
+    # Their usage goes to a throwaway log rather than the real lifetime statistics.
+    usage_log = UsageLog(os.path.join(tempfile.mkdtemp(prefix="sustain-bench-"), "usage.bin"))
+    uncached = SUSTAIN(
+        api_key=None, cache=TieredCache(max_entries=0), api_client=StubOpenAIClient(), usage_log=usage_log
+    )
+    cached = SUSTAIN(api_key=None, cache=TieredCache(), api_client=StubOpenAIClient(), usage_log=usage_log)
+
+    return {
+        "optimize_text": text_optimizer.optimize_text,
+        "recognize_math": math_optimizer.recognize_math,
+        "solve_math": math_optimizer.solve_math,
+        "count_tokens": SUSTAIN.count_tokens,
+        "get_response_uncached": uncached.get_response,
+        "get_response_cached": cached.get_response,
+    }
+
+
+def run(corpus, repeat):
+    """Run every benchmark over every corpus category."""
+    results = {}
+    for name, function in build_benchmarks().items():
+        for category, prompts in corpus.items():
+            function(prompts[0])  # Warm up lazily loaded state
+            results[f"{name}/{category}"] = time_calls(function, prompts, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the benchmarks whose median got slower than the baseline by more than threshold."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or previous["median_us"] <= 0:
+            continue
+        change = result["median_us"] / previous["median_us"] - 1
+        if change > threshold:
+            regressions.append((name, previous["median_us"], result["median_us"], change))
+    return regressions
+
+
+# Main function to run the benchmarks
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SUSTAIN's local hot paths.")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="JSONL corpus of categorized prompts")
+    parser.add_argument("--repeat", type=int, default=50, help="Passes over the corpus per benchmark")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline results JSON to check for regressions")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="Relative slowdown of the median that counts as a regression (default: 0.1)"
+    )
+    args = parser.parse_args()
+
+    results = run(load_corpus(args.corpus), args.repeat)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    for name, result in results.items():
+        print(f"{name:40} median {result['median_us']:10.1f} us   mean {result['mean_us']:10.1f} us")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: {before:.1f} us -> {after:.1f} us (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+# Run the main function
+if __name__ == "__main__":
+    main()